@@ -0,0 +1,4 @@
+"""benchmarks for headcache. Run the suite from the repository root with
+
+    python -m benchmarks --help
+"""
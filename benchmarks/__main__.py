@@ -0,0 +1,260 @@
+"""times the stages of headcache on a synthetic corpus and prints the results
+as JSON. Runs headless, without Qt.
+
+    python -m benchmarks --files 500 --sections 10 --file-size 4000 -o result.json
+"""
+import argparse
+import gc
+import json
+import os
+import os.path
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import mistune
+
+import headcache
+from headcache.core import Headcache, DEFAULT_CONFIG, INDEX_DIRNAME
+from headcache.loader import render_section
+from headcache.md_parser import AstBlockParser
+
+from . import corpus
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+
+    def percentile(p):
+        return timings[min(len(timings) - 1, int(round(p / 100 * (len(timings) - 1))))]
+    return {
+        "count": len(timings),
+        "p50_ms": percentile(50) * 1000,
+        "p95_ms": percentile(95) * 1000,
+        "p99_ms": percentile(99) * 1000,
+        "max_ms": timings[-1] * 1000
+    }
+
+
+def timed(function, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - t0, result
+
+
+def measure_memory(directory, config):
+    """bytes allocated by python for the vocabulary, data and the parse cache
+    after a start with parse cache, measured by dropping them again"""
+    tracemalloc.start()
+    core = Headcache(directory, config)
+    core.load_data()
+    core.sync_vocabulary()
+    gc.collect()
+    loaded = tracemalloc.get_traced_memory()[0]
+    core.vocabulary = None
+    gc.collect()
+    without_vocabulary = tracemalloc.get_traced_memory()[0]
+    core.data.clear()
+    gc.collect()
+    without_data = tracemalloc.get_traced_memory()[0]
+    core.parse_cache.entries.clear()
+    core.parse_cache.filenames.clear()
+    gc.collect()
+    without_cache = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {
+        "loaded_bytes": loaded,
+        "vocabulary_bytes": loaded - without_vocabulary,
+        "data_bytes": without_vocabulary - without_data,
+        "parse_cache_bytes": without_data - without_cache
+    }
+
+
+def make_typo(rng, word):
+    """word with two neighbouring characters swapped"""
+    i = rng.randrange(len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def make_queries(rng, vocabulary, count):
+    """short word starts, two whole words, text from inside of words and
+    words with a typo"""
+    short = [rng.choice(vocabulary)[:rng.randint(2, 3)] for _ in range(count)]
+    long = ["{} {}".format(rng.choice(vocabulary), rng.choice(vocabulary)) for _ in range(count)]
+    long_words = [word for word in vocabulary if len(word) >= 5]
+    inner = [rng.choice(long_words)[1:4] for _ in range(count)]
+    known = set(vocabulary)
+    typo = [typo for typo in (make_typo(rng, rng.choice(long_words)) for _ in range(count)) if typo not in known]
+    return short, long, inner, typo
+
+
+def run(directory, args):
+    config = dict(DEFAULT_CONFIG)
+    config["loader_workers"] = args.workers
+    results = {}
+
+    # start without parse cache
+    shutil.rmtree(os.path.join(directory, INDEX_DIRNAME), ignore_errors=True)
+    vocabulary = corpus.generate(directory, args.files, args.sections, args.file_size, args.seed, args.dirs)
+    texts = []
+    for filename in Headcache(directory, config).list_files():
+        with open(os.path.join(directory, filename), encoding="utf-8") as file:
+            texts.append(mistune.preprocessing(file.read()))
+
+    # parsing and rendering on their own
+    parser = AstBlockParser()
+
+    def parse_all():
+        asts = []
+        for text in texts:
+            parser.clear_ast()
+            parser.parse(text, filename="bench.md")
+            asts.append(parser.ast)
+        return asts
+    duration, asts = timed(parse_all)
+    results["parse_s"] = duration
+
+    sections = [part for ast in asts for part in ast["content"]]
+    results["render_s"], _ = timed(lambda: [render_section(part["title"], part["content"]) for part in sections])
+
+    # load_data, once without and once with parse cache
+    core = Headcache(directory, config)
+    results["load_data_cold_s"], _ = timed(core.load_data)
+    core = Headcache(directory, config)
+    results["load_data_cached_s"], _ = timed(core.load_data)
+    results["stats"] = core.stats()
+    results["memory"] = measure_memory(directory, config)
+
+    rng = random.Random(args.seed)
+    queries = make_queries(rng, vocabulary, args.queries)
+    results["engines"] = {}
+    for engine in args.engines:
+        # a different engine recreates the index, so indexing starts from scratch
+        shutil.rmtree(os.path.join(directory, INDEX_DIRNAME), ignore_errors=True)
+        config["search_engine"] = engine
+        # without query cache, so every search goes to the index
+        core = Headcache(directory, dict(config, search_cache_size=0))
+        core.load_data()
+        results["engines"][engine] = run_engine(core, directory, vocabulary, queries, args)
+
+        core = Headcache(directory, dict(config))
+        core.load_data()
+        results["engines"][engine]["search_typing"] = run_typing(core, rng, vocabulary, args)
+        core.close()
+    return results
+
+
+def run_typing(core, rng, vocabulary, args):
+    """latency of every keystroke while typing two words and deleting the
+    second one again, with the query cache"""
+    timings = []
+    for _ in range(max(1, args.queries // 10)):
+        text = "{} {}".format(rng.choice(vocabulary), rng.choice(vocabulary))
+        keystrokes = [text[:i] for i in range(1, len(text) + 1)]
+        keystrokes += keystrokes[-2:text.index(" "):-1]
+        for query in keystrokes:
+            timings.append(timed(core.search, query, limit=args.limit)[0])
+    return percentiles(timings)
+
+
+def run_engine(core, directory, vocabulary, queries, args):
+    """indexing and search timings with the search engine of core"""
+    results = {}
+
+    # full indexing into a fresh index
+    results["index_full_s"], _ = timed(core.sync_index)
+    index_stats = core.index.stats()
+    for name in ["index_shards", "index_documents", "index_bytes"]:
+        results[name] = index_stats[name]
+
+    # first search opens the searcher, parser and (for prefix) the term dictionary
+    results["first_search_s"], _ = timed(core.search, queries[0][0], limit=args.limit)
+
+    # reindexing a single file after an edit, and the first search after it
+    filename = sorted(core.data)[len(core.data) // 2]
+    with open(os.path.join(directory, filename), "a", encoding="utf-8") as file:
+        file.write("\nappended {} line\n".format(vocabulary[0]))
+    results["reindex_one_s"], _ = timed(lambda: core.update_files(list(core.iter_load([filename], use_cache=False)), set()))
+    results["search_after_reindex_s"], _ = timed(core.search, queries[0][0], limit=args.limit)
+
+    # a day of saving files: many small segments, then merged
+    search_queries = queries[0][:20]
+    filenames = sorted(core.data)
+    for i in range(args.saves):
+        filename = filenames[i % len(filenames)]
+        with open(os.path.join(directory, filename), "a", encoding="utf-8") as file:
+            file.write("\nsaved {} {}\n".format(i, vocabulary[i % len(vocabulary)]))
+        core.update_files(list(core.iter_load([filename], use_cache=False)), set())
+    results["segments_after_saves"] = len(core.index.segments())
+    results["search_fragmented"] = percentiles([timed(core.search, query, limit=args.limit)[0] for query in search_queries])
+    results["merge_s"], _ = timed(core.merge_index)
+    results["segments_after_merge"] = len(core.index.segments())
+    results["search_merged"] = percentiles([timed(core.search, query, limit=args.limit)[0] for query in search_queries])
+
+    # search latency
+    for name, engine_queries in zip(["search_short", "search_long", "search_inner", "search_typo"], queries):
+        timings = []
+        hit_counts = []
+        for query in engine_queries:
+            duration, hits = timed(core.search, query, limit=args.limit)
+            timings.append(duration)
+            hit_counts.append(len(hits))
+        results[name] = percentiles(timings)
+        results[name]["mean_hits"] = sum(hit_counts) / len(hit_counts)
+
+    # lookup of the similar words of a typo on its own, the vocabulary was
+    # built by the first typo search
+    results["vocabulary_words"] = len(core.vocabulary)
+    results["fuzzy_similar"] = percentiles([timed(core.vocabulary.similar, query, core.config["search_fuzzy_expansion"])[0]
+                                            for query in queries[3]])
+
+    core.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--sections", type=int, default=10, help="h2 sections per file")
+    parser.add_argument("--file-size", type=int, default=4000, help="approximate bytes per file")
+    parser.add_argument("--dirs", type=int, default=0, help="top level directories the files are spread over (index shards)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=200, help="number of queries of each kind")
+    parser.add_argument("--limit", type=int, default=DEFAULT_CONFIG["search_result_limit"])
+    parser.add_argument("--engines", default="ngram,prefix", type=lambda text: text.split(","),
+                        help="comma separated search engines to compare (default: ngram,prefix)")
+    parser.add_argument("--saves", type=int, default=50, help="single file updates before merging segments")
+    parser.add_argument("--workers", type=int, default=1, help="loader_workers, 0 = one per cpu")
+    parser.add_argument("--directory", help="where the corpus is generated (default: a temporary directory)")
+    parser.add_argument("-o", "--output", help="JSON file to write (default: stdout)")
+    args = parser.parse_args(argv)
+
+    directory = args.directory or tempfile.mkdtemp(prefix="headcache_bench_")
+    try:
+        results = run(directory, args)
+    finally:
+        if not args.directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    report = {
+        "headcache_version": headcache.__version__,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ["directory", "output"]},
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        print()
+
+
+if __name__ == '__main__':
+    main()
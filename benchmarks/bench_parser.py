@@ -0,0 +1,59 @@
+"""compares the linear AstBlockParser with the original slicing one on files
+of growing size. Run from the repository root with
+
+    python -m benchmarks.bench_parser
+"""
+import time
+
+import mistune
+
+from headcache.md_parser import AstBlockParser
+
+SECTION = """## section {0}
+some text for section {0} with a [link](http://example.com) and *emphasis*
+and a second line
+
+- item one
+- item two
+
+```
+code line
+```
+
+"""
+
+
+def make_note(section_count):
+    return "# benchmark note\n" + "".join(SECTION.format(i) for i in range(section_count))
+
+
+def time_parse(linear, text, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        parser = AstBlockParser(linear=linear)
+        t0 = time.perf_counter()
+        parser.parse(text, filename="bench.md")
+        best = min(best, time.perf_counter() - t0)
+    return best, parser.ast
+
+
+def without_offsets(ast):
+    """ast without the section offsets, which only the linear parser records"""
+    return dict(ast, content=[{key: value for key, value in part.items() if key not in ("start", "end")}
+                              for part in ast["content"]])
+
+
+def main():
+    print("{:>8} {:>8} {:>12} {:>12} {:>8}".format("sections", "lines", "sliced [s]", "linear [s]", "speedup"))
+    for section_count in [250, 1000, 4000, 8000, 16000]:
+        text = mistune.preprocessing(make_note(section_count))
+        t_sliced, ast_sliced = time_parse(False, text)
+        t_linear, ast_linear = time_parse(True, text)
+        if without_offsets(ast_sliced) != without_offsets(ast_linear):
+            raise RuntimeError("parsers disagree for {} sections".format(section_count))
+        print("{:>8} {:>8} {:>12.4f} {:>12.4f} {:>7.1f}x".format(
+            section_count, text.count("\n"), t_sliced, t_linear, t_sliced / t_linear))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""deterministic synthetic note corpora in the format AstBlockParser accepts:
+one h1 title, h2 sections with paragraphs, lists, tables and code blocks"""
+import os
+import os.path
+import random
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "tor", "va", "shi", "ren", "qu", "ab", "el", "dor", "fin", "gal", "hep", "ix"]
+
+
+def make_vocabulary(rng, size=2000):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_sentence(rng, vocabulary, length=12):
+    return " ".join(rng.choice(vocabulary) for _ in range(length)).capitalize() + "."
+
+
+def make_block(rng, vocabulary):
+    kind = rng.random()
+    if kind < 0.55:
+        return " ".join(make_sentence(rng, vocabulary) for _ in range(rng.randint(1, 4))) + "\n\n"
+    if kind < 0.7:
+        return "".join("- {}\n".format(make_sentence(rng, vocabulary, 5)) for _ in range(rng.randint(2, 6))) + "\n"
+    if kind < 0.85:
+        rows = ["| {} | {} |\n".format(rng.choice(vocabulary), rng.choice(vocabulary)) for _ in range(rng.randint(2, 6))]
+        return "| key | value |\n|-----|-------|\n" + "".join(rows) + "\n"
+    lines = ["{} = {}({})\n".format(rng.choice(vocabulary), rng.choice(vocabulary), rng.randint(0, 99))
+             for _ in range(rng.randint(2, 8))]
+    return "```python\n" + "".join(lines) + "```\n\n"
+
+
+def make_note(rng, vocabulary, section_count, file_size):
+    """a note with section_count h2 sections of about file_size bytes in total"""
+    parts = ["# {}\n\n".format(make_sentence(rng, vocabulary, 3)[:-1])]
+    section_size = max(1, file_size // max(1, section_count))
+    for i in range(section_count):
+        parts.append("## {} {}\n".format(make_sentence(rng, vocabulary, 2)[:-1], i))
+        size = 0
+        while size < section_size:
+            block = make_block(rng, vocabulary)
+            parts.append(block)
+            size += len(block)
+    return "".join(parts)
+
+
+def note_path(directory, i, dir_count):
+    """notes are spread over dir_count subdirectories (each with a nested
+    one), or all in directory with dir_count 0"""
+    if dir_count == 0:
+        return os.path.join(directory, "note_{:05d}.md".format(i))
+    subdirectory = os.path.join(directory, "topic_{:03d}".format(i % dir_count))
+    if i // dir_count % 2:
+        subdirectory = os.path.join(subdirectory, "more")
+    os.makedirs(subdirectory, exist_ok=True)
+    return os.path.join(subdirectory, "note_{:05d}.md".format(i))
+
+
+def generate(directory, file_count=100, section_count=10, file_size=4000, seed=0, dir_count=0):
+    """writes file_count notes into directory (see note_path). The same
+    arguments always give the same files. Returns the vocabulary the notes were
+    made of"""
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng)
+    os.makedirs(directory, exist_ok=True)
+    for i in range(file_count):
+        with open(note_path(directory, i, dir_count), "w", encoding="utf-8", newline="\n") as file:
+            file.write(make_note(rng, vocabulary, section_count, file_size))
+    return vocabulary
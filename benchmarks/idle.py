@@ -0,0 +1,97 @@
+"""counts the paint events and cpu time of an idle headcache window. An idle
+window shouldn't repaint anything; exits with status 1 if there were more
+than --max-paints paint events.
+
+    QT_QPA_PLATFORM=offscreen python -m benchmarks.idle --seconds 3
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from PyQt5.QtCore import QObject, QEvent, QTimer
+from PyQt5.QtWidgets import QApplication
+
+from . import corpus
+
+
+class PaintCounter(QObject):
+    """counts the paint events of all widgets while is_counting"""
+
+    def __init__(self):
+        super().__init__()
+        self.is_counting = False
+        self.counts = {}
+
+    def eventFilter(self, obj, event):
+        if self.is_counting and event.type() == QEvent.Paint:
+            name = obj.objectName() or type(obj).__name__
+            self.counts[name] = self.counts.get(name, 0) + 1
+        return False
+
+
+def measure(directory, args):
+    from headcache.headcache import MainFrame
+
+    os.chdir(directory)
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    counter = PaintCounter()
+    app.installEventFilter(counter)
+    frame = MainFrame()
+    frame.show()
+    results = {}
+
+    def wait():
+        # idle once loading and indexing are done
+        widget = frame.main_widget
+        if widget.thread is None or widget.thread.isRunning() or widget.merge_thread.isRunning():
+            QTimer.singleShot(100, wait)
+        else:
+            QTimer.singleShot(int(args.warmup * 1000), start)
+
+    def start():
+        # the file list has focus and a section is shown, as after a start
+        results["cpu_start"] = time.process_time()
+        results["wall_start"] = time.perf_counter()
+        counter.is_counting = True
+        QTimer.singleShot(int(args.seconds * 1000), stop)
+
+    def stop():
+        counter.is_counting = False
+        results["cpu_s"] = time.process_time() - results.pop("cpu_start")
+        results["wall_s"] = time.perf_counter() - results.pop("wall_start")
+        app.quit()
+
+    QTimer.singleShot(0, wait)
+    app.exec_()
+    frame.close()
+    results["paint_events"] = sum(counter.counts.values())
+    results["paint_events_by_widget"] = counter.counts
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.idle", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--warmup", type=float, default=1, help="seconds to wait after indexing")
+    parser.add_argument("--seconds", type=float, default=3, help="idle seconds that are measured")
+    parser.add_argument("--max-paints", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus.generate(directory, args.files)
+        cwd = os.getcwd()
+        try:
+            results = measure(directory, args)
+        finally:
+            os.chdir(cwd)
+    print(json.dumps(results, indent=4))
+    if results["paint_events"] > args.max_paints:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""headcache-cli: index, search and inspect notes without starting the GUI"""
+import argparse
+import json
+import os
+import sys
+
+from .core import Headcache
+from .profiling import profiler
+from .snippets import format_snippet
+
+
+def print_error(error):
+    print(error, file=sys.stderr)
+
+
+def command_index(core, args):
+    with profiler.capture("startup"):
+        core.load_data(on_error=print_error)
+        updated = core.sync_index()
+    print("{} files, {} updated in index".format(len(core.data), updated))
+
+
+def command_search(core, args):
+    # the index is expected to be up to date (GUI or "index" command). Only
+    # the notes of the hits are loaded, see Headcache.on_demand
+    hits = core.search(args.query, limit=args.limit, content=args.json)
+    if args.json:
+        json.dump(hits, sys.stdout, indent=4)
+        print()
+        return
+    for hit in hits:
+        print("{}: {} ({:.2f})".format(hit["path"], hit["title"], hit["score"]))
+        if "content" in hit["matched_fields"]:
+            snippet = format_snippet(hit["snippets"]["content"], template="[{}]", escape=str).replace("\n", " ")
+            print("    " + snippet)
+
+
+def command_stats(core, args):
+    core.load_data(on_error=print_error)
+    stats = core.stats()
+    if args.json:
+        json.dump(stats, sys.stdout, indent=4)
+        print()
+        return
+    for key, value in stats.items():
+        print("{}: {}".format(key, value))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="headcache-cli", description=__doc__)
+    parser.add_argument("-d", "--directory", default=os.getcwd(), help="notes directory (default: working directory)")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    parser_index = subparsers.add_parser("index", help="load all notes and update the search index")
+    parser_index.set_defaults(func=command_index)
+
+    parser_search = subparsers.add_parser("search", help="search the index")
+    parser_search.add_argument("query")
+    parser_search.add_argument("-n", "--limit", type=int, default=10)
+    parser_search.add_argument("--json", action="store_true")
+    parser_search.set_defaults(func=command_search)
+
+    parser_stats = subparsers.add_parser("stats", help="number of files, sections and index size")
+    parser_stats.add_argument("--json", action="store_true")
+    parser_stats.set_defaults(func=command_stats)
+
+    args = parser.parse_args(argv)
+    core = Headcache(args.directory, on_demand=args.command == "search")
+    try:
+        args.func(core, args)
+    finally:
+        core.close()
+    profiler.dump(args.directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,533 @@
+"""Qt-free note collection: loading, parsing, indexing and searching. Used by
+the GUI and by the command line interface (see cli.py). Whoosh is only
+imported once the index is used"""
+import functools
+import json
+import os
+import os.path
+
+from .loader import iter_load, file_stamp, render_section
+from .parse_cache import ParseCache
+from .profiling import profiler
+from .query_cache import QueryCache
+from .ranking import Ranking, RANKING_KEYS
+from .reconcile import iter_notes, snapshot, stat_files, reconcile
+from .snippets import find_spans, best_window, fragments
+from .text_cache import TextCache
+from .vocabulary import Vocabulary, note_words
+
+INDEX_DIRNAME = "indexdir"
+CONFIG_FILENAME = "headcache_config.json"
+
+DEFAULT_CONFIG = {
+    "window_size": [800, 400],
+    "search_title_weight": 3.0,
+    "search_text_weight": 1.0,
+    "search_recency_weight": 0.0,
+    "search_recency_half_life_days": 30,
+    "search_engine": "ngram",
+    "loader_workers": 0,
+    "loader_executor": "process",
+    "preview_cache_mb": 16,
+    "text_cache_files": 256,
+    "watcher_quiet_ms": 300,
+    "watcher_max_delay_ms": 2000,
+    "watcher_max_batch": 500,
+    "reconcile_interval_ms": 60000,
+    "search_debounce_ms": 80,
+    "search_result_limit": 100,
+    "search_snippet_length": 80,
+    "search_fuzzy_distance": 1,
+    "search_fuzzy_expansion": 8,
+    "search_cache_size": 64,
+    "search_threads": 4,
+    "index_max_segments": 8,
+    "index_max_deleted_ratio": 0.2,
+    "index_merge_idle_ms": 30000,
+    "profile": False
+}
+
+
+def load_config(path=CONFIG_FILENAME):
+    config = dict(DEFAULT_CONFIG)
+    try:
+        with open(path) as data_file:
+            config.update(json.load(data_file))
+    except FileNotFoundError:
+        pass
+    return config
+
+
+class Headcache:
+    """the notes (*.md files) of a directory, their parse cache and search
+    index.
+
+    With on_demand (for single searches from the command line), data isn't
+    loaded up front: a search loads the files of its hits, and all files
+    only if it falls back to fuzzy search"""
+
+    def __init__(self, directory, config=None, on_demand=False):
+        self.directory = directory
+        self.on_demand = on_demand
+        self.config = config if config is not None else load_config(os.path.join(directory, CONFIG_FILENAME))
+        profiler.configure(self.config["profile"])
+        self.index_dir = os.path.join(directory, INDEX_DIRNAME)
+
+        self.parse_cache = ParseCache(os.path.join(self.index_dir, "parse_cache.bin"))
+        self.parse_cache.load()
+        self.data = {}
+        # filename -> stamp of files that failed to parse, they're skipped
+        # until they change
+        self.rejected = {}
+        # files whose sections couldn't be indexed because they changed since
+        # they were parsed (see indexing.StaleFileError). They're indexed in
+        # full once they're parsed again
+        self.unindexed = set()
+        self.text_cache = TextCache(directory, self.config["text_cache_files"])
+        self.ranking = Ranking(self.config)
+        self.vocabulary = Vocabulary(self.config["search_fuzzy_distance"])
+
+        self._index = None
+        self._engines = {}
+        self._query_cache = None
+
+    # loading
+
+    def list_files(self):
+        """paths of all notes below directory, relative and "/" separated"""
+        return sorted(path for path, entry in iter_notes(self.directory, [INDEX_DIRNAME]))
+
+    def iter_load(self, filenames=None, use_cache=True):
+        """yields (filename, entry, error) for filenames (all files by
+        default). Unchanged files come from the parse cache first, including
+        files that were renamed, the rest is parsed (see loader_workers config)
+        and put into the cache. data is not changed"""
+        if filenames is None:
+            filenames = self.list_files()
+
+        listed = set(filenames)
+        to_parse = []
+        stamps = {}
+        for filename in filenames:
+            entry = None
+            try:
+                stamp = stamps[filename] = file_stamp(os.path.join(self.directory, filename))
+                if use_cache:
+                    entry = self.parse_cache.get(filename, *stamp)
+                    if entry is None:
+                        entry = self.load_moved(filename, stamp, listed)
+            except OSError:
+                pass
+            if entry is None:
+                to_parse.append(filename)
+            else:
+                yield filename, entry, None
+
+        results = iter_load(self.directory, to_parse,
+                            workers=self.config["loader_workers"], executor=self.config["loader_executor"])
+        for filename, entry, error in results:
+            if error is None:
+                self.parse_cache.put(filename, entry)
+                self.rejected.pop(filename, None)
+            elif filename in stamps:
+                # stamped before parsing, a change while parsing isn't missed
+                self.rejected[filename] = stamps[filename]
+            yield filename, entry, error
+
+    def load_moved(self, filename, stamp, listed):
+        """the cache entry of a file that was renamed to filename, or None"""
+        old_filename = self.parse_cache.find_moved(*stamp, exclude=listed)
+        if old_filename is None or os.path.exists(os.path.join(self.directory, old_filename)):
+            return None
+        self.parse_cache.rename(old_filename, filename)
+        return self.parse_cache.get(filename, *stamp)
+
+    def reconcile(self, filenames=None):
+        """compares the files on disk (all of them, or only filenames) with
+        data, see reconcile.reconcile. Returns (changed, deleted, renamed)"""
+        if filenames is None:
+            stamps = snapshot(self.directory, [INDEX_DIRNAME])
+        else:
+            stamps = stat_files(self.directory, filenames)
+        for filename in list(self.rejected):
+            if filename not in stamps and (filenames is None or filename in filenames):
+                del self.rejected[filename]
+        changed, deleted, renamed = reconcile(stamps, self.data, filenames)
+        changed = {filename for filename in changed if self.rejected.get(filename) != stamps[filename]}
+        return changed, deleted, renamed
+
+    def finish_loading(self):
+        """drops cache entries of files that are gone and saves the cache"""
+        self.parse_cache.retain(self.data)
+        self.parse_cache.save()
+
+    def load_data(self, on_error=print):
+        filenames = self.list_files()
+        loaded = {}
+        for filename, entry, error in self.iter_load(filenames):
+            if error is not None:
+                on_error(error)
+            else:
+                loaded[filename] = entry
+
+        # same order as the directory listing, regardless of completion order
+        self.data.clear()
+        self.data.update((filename, loaded[filename]) for filename in filenames if filename in loaded)
+        self.finish_loading()
+        return self.data
+
+    def load_files(self, filenames):
+        """puts the files of filenames that aren't in data yet into it, see
+        iter_load. Files that fail to parse are left out"""
+        missing = sorted(set(filenames).difference(self.data))
+        for filename, entry, error in self.iter_load(missing):
+            if error is None:
+                self.data[filename] = entry
+        self.parse_cache.save()
+
+    # section texts
+
+    def section_text(self, filename, topic, part):
+        """markdown of a section, read from the file"""
+        return self.text_cache.section_text(filename, topic, part)
+
+    def render_section(self, filename, part, topic=None):
+        """html of a section of a loaded file (or of topic, an entry of it),
+        None if the file changed since it was parsed"""
+        text = self.text_cache.text(filename, self.data[filename] if topic is None else topic)
+        if text is None:
+            return None
+        with profiler.stage("render"):
+            return render_section(part.title, text[part.start:part.end])
+
+    def hit_section(self, hit):
+        """(note, section) a search hit was found in, (None, None) if it's
+        gone"""
+        topic = self.data.get(hit["path"])
+        if topic is None:
+            return None, None
+        # see loader.section_keys
+        occurrence = int(hit["section_id"].rsplit("\n", 1)[1])
+        for part in topic.sections:
+            if part.title == hit["title"]:
+                if occurrence == 0:
+                    return topic, part
+                occurrence -= 1
+        return None, None
+
+    def hit_text(self, hit):
+        """content of the section a search hit was found in, "" if the file
+        changed since"""
+        topic, part = self.hit_section(hit)
+        if part is None:
+            return ""
+        return self.section_text(hit["path"], topic, part)
+
+    def hit_snippets(self, hit):
+        """{"title": parts, "content": parts} of a search hit, see
+        snippets.fragments. Only the window of the content is sliced, but a
+        file that isn't in the text cache is read as a whole first"""
+        length = self.config["search_snippet_length"]
+        windows = hit["snippet_windows"]
+        snippets = {"title": fragments(lambda start, end: hit["title"][start:end], len(hit["title"]),
+                                       windows.get("title", (0, [])), length)}
+        topic, part = self.hit_section(hit)
+        text = None if part is None else self.text_cache.text(hit["path"], topic)
+        if text is None:
+            snippets["content"] = []
+        else:
+            snippets["content"] = fragments(lambda start, end: text[part.start + start:part.start + end],
+                                            part.end - part.start, windows.get("content", (0, [])), length)
+        return snippets
+
+    def hit_fields(self, hit):
+        return {"title": hit["title"], "content": self.hit_text(hit)}
+
+    # index
+
+    @property
+    def index(self):
+        if self._index is None:
+            from .index_manager import IndexManager
+            self._index = IndexManager(self.index_dir, self.config, self.ranking)
+        return self._index
+
+    def sync_index(self):
+        """updates the index for all files in data that changed since they
+        were indexed. Files that changed since they were parsed are skipped
+        and put into unindexed. Returns the number of updated files"""
+        with profiler.stage("index"):
+            updated, stale = self.index.sync(self.data, self.text_cache.text)
+        self.unindexed = set(stale)
+        if updated and self._query_cache is not None:
+            self._query_cache.clear()
+        return updated
+
+    def sync_vocabulary(self):
+        """updates the vocabulary (for fuzzy search) with the files in data
+        that changed since. Built on the first fuzzy search, which reads all
+        files, update_files keeps it up to date after that"""
+        if self.config["search_fuzzy_distance"] <= 0:
+            return
+        data = dict(self.data)
+        for filename, topic in data.items():
+            if not self.vocabulary.is_current(filename, topic):
+                self.update_vocabulary(filename, topic)
+        for filename in set(self.vocabulary.files).difference(data):
+            self.vocabulary.remove(filename)
+
+    def update_vocabulary(self, filename, topic):
+        """the words are read from the file. If it changed since it was
+        parsed, it's updated once it's parsed again"""
+        text = self.text_cache.text(filename, topic)
+        if text is not None:
+            self.vocabulary.update(filename, topic, note_words(text))
+
+    def update_files(self, results, deleted, renamed=None, on_error=print):
+        """applies reparsed files (as yielded by iter_load), deleted files and
+        renamed files ({old filename: new filename}) to data, the parse cache
+        and the index, with a single commit. Renamed files keep their parsed
+        entry unless they are among the results, too. Only the sections of
+        modified files that changed are rewritten in the index. Parse errors
+        go to on_error, like in load_data. Files that changed again since
+        they were parsed are left out of the index and put into unindexed.
+        Returns (added, modified, removed, renamed) filenames, renamed as
+        a {old filename: new filename} dict"""
+        with profiler.stage("update_files"):
+            return self._update_files(results, deleted, renamed, on_error)
+
+    def _update_files(self, results, deleted, renamed, on_error):
+        from .indexing import topic_sections, update_topic, StaleFileError
+
+        added, modified, removed = [], [], set(deleted)
+        reparsed = {filename for filename, entry, error in results if error is None}
+        moved = {}
+        changes = 0
+        writers = self.index.writer()
+        for old_filename, new_filename in sorted((renamed or {}).items()):
+            entry = self.data.pop(old_filename, None)
+            if entry is None:
+                continue
+            # the new name might have been an existing file
+            writers(old_filename).delete_by_term("path", old_filename)
+            writers(new_filename).delete_by_term("path", new_filename)
+            self.data[new_filename] = entry
+            self.parse_cache.rename(old_filename, new_filename)
+            self.unindexed.discard(old_filename)
+            if new_filename not in reparsed:
+                try:
+                    update_topic(writers(new_filename), new_filename, {}, entry, self.text_cache.text)
+                    self.unindexed.discard(new_filename)
+                except StaleFileError:
+                    self.unindexed.add(new_filename)
+            moved[old_filename] = new_filename
+            changes += 1
+
+        for filename, entry, error in results:
+            if error is not None:
+                on_error(error)
+                removed.add(filename)
+                continue
+
+            old_entry = self.data.get(filename)
+            if filename in moved.values():
+                # its documents were deleted above
+                indexed = {}
+            elif old_entry is None:
+                writers(filename).delete_by_term("path", filename)
+                indexed = {}
+                added.append(filename)
+            else:
+                if filename in self.unindexed:
+                    writers(filename).delete_by_term("path", filename)
+                    indexed = {}
+                else:
+                    indexed = {doc_id: part.hash for doc_id, part in topic_sections(filename, old_entry).items()}
+                modified.append(filename)
+            try:
+                changes += update_topic(writers(filename), filename, indexed, entry, self.text_cache.text)
+                self.unindexed.discard(filename)
+            except StaleFileError:
+                # it's reparsed with the event of the change
+                writers(filename).delete_by_term("path", filename)
+                self.unindexed.add(filename)
+                changes += 1
+            self.parse_cache.put(filename, entry)
+            self.data[filename] = entry
+
+        for filename in removed:
+            self.parse_cache.discard(filename)
+            self.unindexed.discard(filename)
+            # files that failed to parse before have no documents
+            if filename in self.data:
+                writers(filename).delete_by_term("path", filename)
+                changes += 1
+        removed = sorted(filename for filename in removed if self.data.pop(filename, None) is not None)
+
+        # once it's built, see sync_vocabulary
+        if self.config["search_fuzzy_distance"] > 0 and self.vocabulary.files:
+            for filename in list(moved) + removed:
+                self.vocabulary.remove(filename)
+            for filename in added + modified + list(moved.values()):
+                if filename in self.data:
+                    self.update_vocabulary(filename, self.data[filename])
+
+        if changes or added:
+            self.index.commit(writers)
+            if self._query_cache is not None:
+                updated = added + modified + list(moved.values())
+                sections = [{"title": part.title, "content": self.section_text(filename, self.data[filename], part)}
+                            for filename in updated for part in self.data[filename].sections]
+                self._query_cache.invalidate(updated + removed + list(moved), sections)
+        else:
+            writers.cancel()
+        return added, modified, removed, moved
+
+    # search
+
+    def index_changed(self):
+        """the searcher is refreshed before the next search"""
+        self.index.changed()
+
+    def needs_merge(self):
+        return self.index.needs_merge()
+
+    def merge_index(self):
+        """merges small index segments, see IndexManager.merge. Not to be run
+        while files are updated"""
+        with profiler.stage("merge"):
+            return self.index.merge()
+
+    def engine(self, key):
+        """the search engine of a shard"""
+        engine = self._engines.get(key)
+        if engine is None:
+            from .engines import get_engine
+            engine = self._engines[key] = get_engine(self.config["search_engine"])(self.index.shard(key).ix, self.ranking)
+        return engine
+
+    def reload_config(self):
+        """applies the ranking keys of the config file, which take effect
+        with the next search. Returns whether they changed"""
+        try:
+            config = load_config(os.path.join(self.directory, CONFIG_FILENAME))
+        except ValueError:
+            # caught in the middle of saving
+            return False
+        changed = {key: config[key] for key in RANKING_KEYS if config[key] != self.config[key]}
+        if not changed:
+            return False
+        self.config.update(changed)
+        self.ranking.update(self.config)
+        if self._query_cache is not None:
+            self._query_cache.clear()
+        return True
+
+    def search(self, text, limit=10, content=False):
+        """stored fields of the hits for text, plus their "score",
+        "matched_fields" (title and/or content) and "snippets" (see
+        hit_snippets). With content, also the "content" of the sections (read
+        from the files). Recent queries are answered from the query cache"""
+        with profiler.stage("search"), profiler.capture_search(text):
+            hits = self._search(text, limit)
+        if self.on_demand:
+            self.load_files(hit["path"] for hit in hits)
+        results = []
+        for hit in hits:
+            result = dict(hit, snippets=self.hit_snippets(hit))
+            del result["snippet_windows"]
+            if content:
+                result["content"] = self.hit_text(hit)
+            results.append(result)
+        return results
+
+    def _search(self, text, limit):
+        if self._query_cache is None:
+            self._query_cache = QueryCache(self.engine(""), self.config["search_cache_size"], self.hit_fields)
+
+        hits = self._query_cache.get(text, limit)
+        if hits:
+            self.add_snippet_windows(text, [hit for hit in hits if "snippet_windows" not in hit])
+            return hits
+
+        # engines are created here and not on the search threads
+        for key in list(self.index.shards):
+            self.engine(key)
+
+        # an empty cached result is that of the exact search
+        if hits is None:
+            hits = self.index.search(self.shard_searcher(lambda engine, searcher: engine.search(
+                text, searcher, limit=limit, terms=True)), limit)
+        is_fuzzy = not hits and self.config["search_fuzzy_distance"] > 0
+        if is_fuzzy:
+            with profiler.stage("vocabulary"):
+                if self.on_demand:
+                    self.load_files(self.list_files())
+                self.sync_vocabulary()
+            expansion = self.config["search_fuzzy_expansion"]
+            similar = functools.lru_cache()(lambda word: self.vocabulary.similar(word, expansion))
+            hits = self.index.search(self.shard_searcher(lambda engine, searcher: searcher.search(
+                engine.fuzzy_parse(text, searcher, similar), limit=limit, terms=True)), limit)
+        self._query_cache.put(text, limit, hits, is_fuzzy)
+        return hits
+
+    def shard_searcher(self, search):
+        """search_shard function for IndexManager.search: runs
+        search(engine, searcher) and turns the results into hits"""
+        from .engines import FIELDS
+
+        length = self.config["search_snippet_length"]
+
+        def search_shard(key, searcher):
+            results = search(self._engines[key], searcher)
+            # only title and content store the offsets of their terms
+            terms = sorted({term for result in results for term in result.matched_terms() if term[0] in FIELDS})
+            spans = find_spans(searcher, [result.docnum for result in results], terms)
+            shard_hits = []
+            for result in results:
+                hit = result.fields()
+                # only needed to sync the index
+                del hit["section_hash"]
+                hit["score"] = result.score
+                hit["matched_fields"] = sorted({field for field, term in result.matched_terms()})
+                hit["snippet_windows"] = {fieldname: best_window(field_spans, length)
+                                          for fieldname, field_spans in spans[result.docnum].items()}
+                shard_hits.append(hit)
+            return shard_hits
+        return search_shard
+
+    def add_snippet_windows(self, text, hits):
+        """snippet windows of hits that were narrowed by the query cache, with
+        the terms of text looked up in their documents"""
+        from .engines import FIELDS
+        from .index_manager import shard_key
+
+        length = self.config["search_snippet_length"]
+        by_shard = {}
+        for hit in hits:
+            by_shard.setdefault(shard_key(hit["path"]), []).append(hit)
+        for key, shard_hits in by_shard.items():
+            searcher = self.index.shard(key).get_searcher()
+            query = self.engine(key).parse(text, searcher)
+            terms = sorted(term for term in query.all_terms() if term[0] in FIELDS)
+            docnums = [searcher.document_number(section_id=hit["section_id"]) for hit in shard_hits]
+            spans = find_spans(searcher, [docnum for docnum in docnums if docnum is not None], terms)
+            for hit, docnum in zip(shard_hits, docnums):
+                hit["snippet_windows"] = {fieldname: best_window(field_spans, length)
+                                          for fieldname, field_spans in spans.get(docnum, {}).items()}
+
+    def close(self):
+        if self._index is not None:
+            self._index.close_searcher()
+
+    def stats(self):
+        section_count = sum(len(topic.sections) for topic in self.data.values())
+        stats = {
+            "files": len(self.data),
+            "sections": section_count,
+            "bytes": sum(topic.size for topic in self.data.values()),
+            "parse_cache_entries": len(self.parse_cache.entries),
+        }
+        if os.path.exists(self.index_dir):
+            stats.update(self.index.stats())
+        return stats
@@ -0,0 +1,202 @@
+"""search engines, chosen with the "search_engine" config key. An engine
+decides how title and content are analyzed when indexing and turns the typed
+text into a whoosh query.
+
+ngram: every 2-8 character substring of every word is indexed, so any part
+of a word matches directly. Big index, slow to build.
+
+prefix: only the 2-8 character prefixes of every word are indexed, so typing
+the start of a word is a single term lookup. Text inside of a word is found
+with a dictionary of the indexed terms kept in memory: every word containing
+"ext" has an indexed prefix ending with "ext" ("text", "next", ...).
+
+Both weight the fields with the query (see ranking.py), not in the index.
+If nothing is found, words can be replaced with similar words of the notes
+(see fuzzy_parse and vocabulary.py)."""
+import bisect
+
+from whoosh.analysis import StandardAnalyzer, NgramFilter
+from whoosh.qparser import MultifieldParser
+from whoosh.query import And, Or, Term, NullQuery
+
+FIELDS = ["title", "content"]
+NGRAM_MIN = 2
+NGRAM_MAX = 8
+# weight of the similar words of fuzzy_parse, compared to the typed ones
+FUZZY_BOOST = 0.5
+# characters and words with a meaning in whoosh's query language
+QUERY_SYNTAX = set("\"'():*?[]{}^~")
+QUERY_OPERATORS = {"AND", "OR", "NOT", "ANDNOT", "ANDMAYBE"}
+
+
+class Engine:
+    """query side of an engine. plain_words(), can_narrow(words) and, for
+    engines that can narrow, match_fields(words, fields) are used by the
+    QueryCache to filter earlier hits in memory"""
+    word_analyzer = StandardAnalyzer()
+
+    def words(self, text):
+        """the words of text as they are searched for"""
+        return [token.text for token in self.word_analyzer(text)]
+
+    @staticmethod
+    def is_plain(text):
+        """whether text is nothing but words, without query syntax
+        (operators, quotes, field:terms, ...) that words() drops"""
+        return not QUERY_SYNTAX.intersection(text) and not QUERY_OPERATORS.intersection(text.split())
+
+    def plain_words(self, text):
+        """words() of text if it is_plain, None otherwise"""
+        return self.words(text) if self.is_plain(text) else None
+
+    def fuzzy_parse(self, text, searcher, similar):
+        """query for text in which every word can also match one of
+        similar(word), the words of the notes it might be a typo of. Both
+        engines index the prefixes of words, so a similar word is found by
+        its longest indexed prefix"""
+        weights = self.ranking.field_weights
+        word_queries = []
+        for word in self.words(text):
+            alternatives = [self.parse(word, searcher)]
+            for candidate in similar(word):
+                alternatives.extend(Term(fieldname, candidate[:NGRAM_MAX], boost=weights[fieldname] * FUZZY_BOOST)
+                                    for fieldname in FIELDS)
+            word_queries.append(Or(alternatives))
+        if not word_queries:
+            return NullQuery
+        return And(word_queries)
+
+
+class NgramEngine(Engine):
+    def __init__(self, ix, ranking):
+        self.schema = ix.schema
+        self.ranking = ranking
+        self.weights = None
+        self.parser = None
+
+    @staticmethod
+    def analyzer():
+        return StandardAnalyzer() | NgramFilter(minsize=NGRAM_MIN, maxsize=NGRAM_MAX)
+
+    def parse(self, text, searcher):
+        # the parser is made again when the weights were changed
+        if self.ranking.field_weights != self.weights:
+            self.weights = dict(self.ranking.field_weights)
+            self.parser = MultifieldParser(FIELDS, self.schema, fieldboosts=self.weights)
+        return self.parser.parse(text)
+
+    def search(self, text, searcher, **kwargs):
+        return searcher.search(self.parse(text, searcher), **kwargs)
+
+    def can_narrow(self, words):
+        # a hit contains each word, unless it's longer than the ngrams
+        return bool(words) and all(len(word) <= NGRAM_MAX for word in words)
+
+    def match_fields(self, words, fields):
+        """fields ("title", "content") in which words are found, empty if not
+        all words are found. Like in the index, a word has to be part of one
+        of the analyzed words of a field (stop words and single characters
+        are dropped)"""
+        # analyzed words don't contain spaces, so a match can't span two
+        texts = {fieldname: " ".join(self.words(fields[fieldname])) for fieldname in FIELDS}
+        matched = set()
+        for word in words:
+            found = [fieldname for fieldname in FIELDS if word in texts[fieldname]]
+            if not found:
+                return []
+            matched.update(found)
+        return sorted(matched)
+
+
+class SuffixDictionary:
+    """indexed terms of one field, sorted by their reversed text to find the
+    terms ending with a text by bisection"""
+
+    def __init__(self, terms):
+        self.reversed_terms = sorted(term[::-1] for term in terms)
+
+    def __len__(self):
+        return len(self.reversed_terms)
+
+    def ending_with(self, text, limit):
+        """at most limit terms that end with text, text itself excluded"""
+        key = text[::-1]
+        terms = []
+        i = bisect.bisect_left(self.reversed_terms, key)
+        while i < len(self.reversed_terms) and len(terms) < limit and self.reversed_terms[i].startswith(key):
+            if len(self.reversed_terms[i]) > len(key):
+                terms.append(self.reversed_terms[i][::-1])
+            i += 1
+        return terms
+
+
+class PrefixEngine(Engine):
+    # upper bound for the inner word matches of one typed word. whoosh gets
+    # slow with big unions of terms
+    max_expansion = 16
+
+    def __init__(self, ix, ranking):
+        self.ranking = ranking
+        self.dictionaries = {}
+        self.reader = None
+
+    @staticmethod
+    def analyzer():
+        return StandardAnalyzer() | NgramFilter(minsize=NGRAM_MIN, maxsize=NGRAM_MAX, at="start")
+
+    def can_narrow(self, words):
+        # the inner matches of a longer word aren't necessarily among the
+        # bounded inner matches of a shorter one
+        return False
+
+    def dictionary(self, fieldname, reader):
+        """built on first use after the index changed"""
+        if reader is not self.reader:
+            self.dictionaries.clear()
+            self.reader = reader
+        dictionary = self.dictionaries.get(fieldname)
+        if dictionary is None:
+            dictionary = SuffixDictionary(reader.field_terms(fieldname))
+            self.dictionaries[fieldname] = dictionary
+        return dictionary
+
+    def parse(self, text, searcher, inner=True):
+        """every typed word has to match the start (or with inner, also the
+        inside) of a word in title or content"""
+        reader = searcher.reader()
+        words = [word[:NGRAM_MAX] for word in self.words(text)]
+        if not words:
+            return NullQuery
+
+        weights = self.ranking.field_weights
+        word_queries = []
+        for word in words:
+            alternatives = []
+            for fieldname in FIELDS:
+                alternatives.append(Term(fieldname, word, boost=weights[fieldname]))
+                if inner:
+                    alternatives.extend(Term(fieldname, term, boost=weights[fieldname]) for term in
+                                        self.dictionary(fieldname, reader).ending_with(word, self.max_expansion))
+            word_queries.append(Or(alternatives))
+        return And(word_queries)
+
+    def search(self, text, searcher, **kwargs):
+        """word starts are cheap to search, inner matches only fill up the
+        results if there are fewer than limit"""
+        results = searcher.search(self.parse(text, searcher, inner=False), **kwargs)
+        if kwargs.get("limit") is not None and results.scored_length() >= kwargs["limit"]:
+            return results
+        return searcher.search(self.parse(text, searcher), **kwargs)
+
+
+ENGINES = {
+    "ngram": NgramEngine,
+    "prefix": PrefixEngine
+}
+
+
+def get_engine(name):
+    try:
+        return ENGINES[name]
+    except KeyError:
+        raise ValueError("unknown search_engine {!r}, expected one of {}".format(name, ", ".join(sorted(ENGINES))))
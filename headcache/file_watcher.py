@@ -1,16 +1,43 @@
 import logging
+import os.path
 
 from watchdog.events import FileSystemEventHandler
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtCore import Qt, QThread, QObject, QTimer, QElapsedTimer, pyqtSignal
+
+from .reconcile import is_note, is_note_directory
 
 
 class FileChangeWatcher(FileSystemEventHandler, QThread):
+    """turns watchdog events below directory into signals with the relative,
+    "/" separated paths of notes (see reconcile.is_note). Directories that
+    are created, deleted or moved can contain any number of notes, they
+    emit signal_rescan instead, unless they're excluded or hidden (whoosh
+    creates and deletes a directory on every commit). Changes of
+    config_filename (relative to directory) emit signal_config_changed"""
     signal_deleted = pyqtSignal(str)
     signal_modified = pyqtSignal(str)
     signal_added = pyqtSignal(str)
+    signal_moved = pyqtSignal(str, str)
+    signal_rescan = pyqtSignal()
+    signal_config_changed = pyqtSignal()
 
-    def __init__(self):
+    def __init__(self, directory, exclude=(), config_filename=None):
         super().__init__()
+        self.directory = directory
+        self.exclude = exclude
+        self.config_filename = config_filename
+
+    def note_path(self, path):
+        """path relative to directory if it is a note, None otherwise"""
+        path = os.path.relpath(path, self.directory).replace(os.sep, "/")
+        return path if is_note(path, self.exclude) else None
+
+    def is_note_directory(self, path):
+        return is_note_directory(os.path.relpath(path, self.directory).replace(os.sep, "/"), self.exclude)
+
+    def check_config(self, path):
+        if self.config_filename is not None and os.path.relpath(path, self.directory) == self.config_filename:
+            self.signal_config_changed.emit()
 
     def on_moved(self, event):
         # super(LoggingEventHandler, self).on_moved(event)
@@ -19,19 +46,113 @@ class FileChangeWatcher(FileSystemEventHandler, QThread):
         logging.info("Moved %s: from %s to %s", what, event.src_path,
                      event.dest_path)
 
+        if event.is_directory:
+            if self.is_note_directory(event.src_path) or self.is_note_directory(event.dest_path):
+                self.signal_rescan.emit()
+            return
+        # editors often save by writing a temporary file and renaming it
+        self.check_config(event.dest_path)
+        src_filename = self.note_path(event.src_path)
+        dest_filename = self.note_path(event.dest_path)
+        if src_filename or dest_filename:
+            self.signal_moved.emit(src_filename or "", dest_filename or "")
+
     def on_created(self, event):
         # super(LoggingEventHandler, self).on_created(event)
 
-        if not event.is_directory and event.src_path.endswith(".md"):
-            filename = event.src_path.split(u"\\")[-1]
+        if event.is_directory:
+            if self.is_note_directory(event.src_path):
+                self.signal_rescan.emit()
+            return
+        self.check_config(event.src_path)
+        filename = self.note_path(event.src_path)
+        if filename:
             self.signal_added.emit(filename)
 
     def on_deleted(self, event):
-        if not event.is_directory and event.src_path.endswith(".md"):
-            filename = event.src_path.split(u"\\")[-1]
+        if event.is_directory:
+            if self.is_note_directory(event.src_path):
+                self.signal_rescan.emit()
+            return
+        filename = self.note_path(event.src_path)
+        if filename:
             self.signal_deleted.emit(filename)
 
     def on_modified(self, event):
-        if not event.is_directory and event.src_path.endswith(".md"):
-            filename = event.src_path.split(u"\\")[-1]
+        if not event.is_directory:
+            self.check_config(event.src_path)
+        filename = None if event.is_directory else self.note_path(event.src_path)
+        if filename:
             self.signal_modified.emit(filename)
+
+
+class EventCoalescer(QObject):
+    """collects file events until there were none for quiet_ms (or the oldest
+    pending event is max_delay_ms old) and emits them as one batch. Events are
+    deduplicated per file, only the resulting state counts: a file is either
+    changed (added or modified) or deleted.
+
+    A batch of more than max_batch files is dropped and overflow emitted
+    instead, the whole directory should be compared then. The same happens
+    when the watcher asks for a rescan"""
+    batch_ready = pyqtSignal(set, set)
+    overflow = pyqtSignal()
+
+    def __init__(self, quiet_ms=300, max_delay_ms=2000, max_batch=500, parent=None):
+        super().__init__(parent)
+        self.max_delay_ms = max_delay_ms
+        self.max_batch = max_batch
+        self.changed = set()
+        self.deleted = set()
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(quiet_ms)
+        self.timer.timeout.connect(self.flush)
+        self.age = QElapsedTimer()
+
+    def connect_watcher(self, watcher):
+        watcher.signal_added.connect(self.file_changed)
+        watcher.signal_modified.connect(self.file_changed)
+        watcher.signal_deleted.connect(self.file_deleted)
+        watcher.signal_moved.connect(self.file_moved)
+        watcher.signal_rescan.connect(self.rescan)
+
+    def file_changed(self, filename):
+        self.deleted.discard(filename)
+        self.changed.add(filename)
+        self.schedule()
+
+    def file_deleted(self, filename):
+        self.changed.discard(filename)
+        self.deleted.add(filename)
+        self.schedule()
+
+    def file_moved(self, src_filename, dest_filename):
+        if src_filename.endswith(".md"):
+            self.file_deleted(src_filename)
+        if dest_filename.endswith(".md"):
+            self.file_changed(dest_filename)
+
+    def rescan(self):
+        self.timer.stop()
+        self.changed, self.deleted = set(), set()
+        self.overflow.emit()
+
+    def schedule(self):
+        if len(self.changed) + len(self.deleted) > self.max_batch:
+            self.rescan()
+            return
+        if not self.timer.isActive():
+            self.age.start()
+        elif self.age.elapsed() >= self.max_delay_ms:
+            self.flush()
+            return
+        self.timer.start()
+
+    def flush(self):
+        self.timer.stop()
+        if self.changed or self.deleted:
+            changed, deleted = self.changed, self.deleted
+            self.changed, self.deleted = set(), set()
+            self.batch_ready.emit(changed, deleted)
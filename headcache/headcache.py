@@ -1,78 +1,123 @@
+import difflib
 import json
 import logging
-import mistune
 # import sys
 # sys.path.append("c:/dropbox/headcache")
 # sys.path.append("c:/dropbox/headcache/headcache")
 import os
 import os.path
+import sys
 
 import watchdog.observers
 from PyQt5 import QtCore
 from PyQt5.Qt import QDesktopServices, QIcon, QPixmap, QColor
-from PyQt5.QtCore import QDir, pyqtSignal, QFile, QFileInfo, QTimer, QUrl
+from PyQt5.QtCore import pyqtSignal, QTimer, QUrl, QThread, QElapsedTimer, QStringListModel
 from PyQt5.QtCore import QRect
 from PyQt5.QtCore import QSize
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import (QApplication, QWidget, QMainWindow, QHBoxLayout, QFrame,
-                             QLabel, QVBoxLayout, QSplitter)
-from PyQt5.QtWidgets import QListView, QStyleFactory
-from PyQt5.QtWidgets import QListWidgetItem
+                             QVBoxLayout, QSplitter)
+from PyQt5.QtWidgets import QListView, QStyleFactory, QAbstractItemView, QLabel
 
-from .md_parser import AstBlockParser, BadFormatError
-# from md_parser import AstBlockParser
+from .loader import section_keys
+# from loader import section_keys
 
-from .search import Overlay, IndexWorker
-# from search import Overlay, IndexWorker
+from .core import Headcache, load_config, INDEX_DIRNAME, CONFIG_FILENAME
+# from core import Headcache, load_config, INDEX_DIRNAME, CONFIG_FILENAME
 
-from .ui_components import SearchBar, IndicatorList, IndicatorTextBrowser
-# from ui_components import SearchBar, IndicatorList, IndicatorTextBrowser
+from .profiling import profiler
+# from profiling import profiler
 
-from whoosh.analysis import StandardAnalyzer, NgramFilter
-from whoosh.fields import *
-from whoosh.index import create_in
-from whoosh.qparser import MultifieldParser
+from .html_cache import HtmlCache
+# from html_cache import HtmlCache
 
-from .file_watcher import FileChangeWatcher
-# from file_watcher import FileChangeWatcher
-import pkg_resources
-
-
-
-class IdRenderer(mistune.Renderer):
-    def header(self, text, level, raw):
-        return '<h{0} id="{1}">{1}</h{0}>\n'.format(level, text)
-
-
-class FileListItemWidget(QWidget):
-    def __init__(self, title: str, filename, parent=None):
-        super().__init__(parent)
-
-        self.real_parent = parent
-
-        layout = QVBoxLayout()
-        self.label_title = QLabel(title)
-        self.label_filename = QLabel(filename)
-        layout.addWidget(self.label_title)
-        layout.addWidget(self.label_filename)
-        self.label_title.setObjectName("file_list_title")
-        self.label_filename.setObjectName("file_list_filename")
-        layout.setAlignment(self.label_filename, Qt.AlignRight)
-        layout.setContentsMargins(2, 0, 2, 2)
-        layout.setSpacing(0)
-        self.setLayout(layout)
-
-    def get_title(self):
-        return self.label_title.text()
+from .search import Overlay, IndexWorker, MergeWorker, SearchWorker
+# from search import Overlay, IndexWorker, MergeWorker, SearchWorker
 
-    def get_filename(self):
-        return self.label_filename.text()
+from .ui_components import SearchBar, IndicatorList, IndicatorTextBrowser, FileListModel, FileListDelegate
+# from ui_components import SearchBar, IndicatorList, IndicatorTextBrowser, FileListModel, FileListDelegate
 
-    def set_modified(self, mod):
-        self.label_title.setProperty("modified", mod)
+from .file_watcher import FileChangeWatcher, EventCoalescer
+# from file_watcher import FileChangeWatcher, EventCoalescer
+import pkg_resources
 
-        self.label_title.style().unpolish(self.label_title)
-        self.label_title.style().polish(self.label_title)
+# stages shown in the status bar (p50/p95) when profiling is switched on
+PROFILE_STATUS_STAGES = ["search_with", "show_results", "render", "commit"]
+
+
+class LoadWorker(QThread):
+    """loads all notes of a directory in the background. Results are sent to
+    the GUI in batches, cached files first"""
+    batch_loaded = pyqtSignal(list)
+    progress = pyqtSignal(int, int)
+    bad_format = pyqtSignal(str)
+
+    # a batch is sent when it is this big or this old (ms), whichever is first
+    batch_size = 200
+    batch_interval = 100
+
+    def __init__(self, parent=None):
+        QThread.__init__(self, parent)
+
+    def begin(self, core):
+        self.core = core
+        self.start()
+
+    def run(self):
+        with profiler.stage("load"), profiler.capture("startup"):
+            self.load()
+
+    def load(self):
+        filenames = self.core.list_files()
+        batch = []
+        loaded_count = 0
+        timer = QElapsedTimer()
+        timer.start()
+
+        results = self.core.iter_load(filenames)
+        for filename, entry, error in results:
+            if self.isInterruptionRequested():
+                results.close()
+                return
+            if error is not None:
+                self.bad_format.emit(str(error))
+            else:
+                batch.append((filename, entry))
+            loaded_count += 1
+
+            if batch and (len(batch) >= self.batch_size or timer.elapsed() >= self.batch_interval):
+                self.batch_loaded.emit(batch)
+                self.progress.emit(loaded_count, len(filenames))
+                batch = []
+                timer.restart()
+        if batch:
+            self.batch_loaded.emit(batch)
+        self.progress.emit(loaded_count, len(filenames))
+
+
+class ReparseWorker(QThread):
+    """parses a batch of changed files and applies it to the core's data and
+    index (see Headcache.update_files) off the GUI thread. updated is sent
+    with the (added, modified, removed, renamed) filenames and the new
+    entries of the added, modified and renamed files"""
+    updated = pyqtSignal(tuple, dict)
+
+    def __init__(self, parent=None):
+        QThread.__init__(self, parent)
+
+    def begin(self, core, filenames, deleted, renamed):
+        self.core = core
+        self.filenames = filenames
+        self.deleted = deleted
+        self.renamed = renamed
+        self.start()
+
+    def run(self):
+        results = list(self.core.iter_load(self.filenames, use_cache=False))
+        changes = self.core.update_files(results, self.deleted, self.renamed)
+        added, modified, removed, renamed = changes
+        entries = {filename: self.core.data[filename] for filename in added + modified + list(renamed.values())}
+        self.updated.emit(changes, entries)
 
 
 class MainWidget(QFrame):  # QDialog #QMainWindow
@@ -84,268 +129,319 @@ class MainWidget(QFrame):  # QDialog #QMainWindow
         with open(pkg_resources.resource_filename("headcache", 'preview_style.css')) as file_style:
             self.preview_css_str = '<style type="text/css">{}</style>'.format(file_style.read())
 
-        # markdown
-        self.ast_generator = AstBlockParser()
-        self.markdowner_simple = mistune.Markdown(renderer=IdRenderer())
-
-        # stored data
-        self.data = self.load_data()
+        self.config = self.load_config()
+        self.core = Headcache(os.getcwd(), self.config)
+
+        # rendered html of the sections that were viewed (and their neighbours)
+        self.html_cache = HtmlCache(self.render_section, self.config["preview_cache_mb"] * 1024 * 1024)
+
+        # the entries shown in the lists. The same as the core's data, but
+        # only changed on the GUI thread, while file changes are applied to
+        # the core on the reparse thread. Filled in the background by
+        # LoadWorker, see start_loading()
+        self.data = {}
+        self.is_started = False
+        self.is_patching_parts = False
+        self.load_thread = None
+        self.thread = None
+
+        # file changes that arrived while the index was busy, see files_changed()
+        self.pending_changed = set()
+        self.pending_deleted = set()
+        self.is_reconcile_pending = False
+        self.reparse_thread = ReparseWorker()
+        self.reparse_thread.updated.connect(self.files_reparsed)
         self.usage_mode = "browse"
         self.initUI()
 
-        self.config = self.load_config()
-
-        # setup search index
-        analyzer_typing = StandardAnalyzer() | NgramFilter(minsize=2, maxsize=8)
-        schema = Schema(
-            title=TEXT(stored=True, analyzer=analyzer_typing, field_boost=self.config["search_title_weight"]),
-            content=TEXT(stored=True, analyzer=analyzer_typing, field_boost=self.config["search_text_weight"]),
-            time=STORED,
-            path=ID(stored=True),
-            tags=KEYWORD)
-        if not os.path.exists("indexdir"):
-            os.mkdir("indexdir")
-        self.ix = create_in("indexdir", schema)
+        # small segments left by file updates are merged once the files
+        # didn't change for a while
+        self.merge_thread = MergeWorker()
+        self.merge_thread.finished.connect(self.index_merged)
+        self.merge_timer = QTimer(self)
+        self.merge_timer.setSingleShot(True)
+        self.merge_timer.setInterval(self.config["index_merge_idle_ms"])
+        self.merge_timer.timeout.connect(self.start_merge)
+        self.index_label = QLabel(self)
+        self.parent().statusBar().addPermanentWidget(self.index_label)
+
+        # stage timings, see profiling.py
+        self.profile_label = QLabel(self)
+        self.profile_timer = QTimer(self)
+        self.profile_timer.setInterval(1000)
+        self.profile_timer.timeout.connect(self.update_profile_status)
+        if profiler.enabled:
+            self.parent().statusBar().addPermanentWidget(self.profile_label)
+            self.profile_timer.start()
+
+        # searches run on their own thread, see search_with()
+        self.search_worker = SearchWorker(self.core, self.config["search_result_limit"])
+        self.search_worker.results_ready.connect(self.search_finished)
+        self.search_worker.start()
+        self.search_text = ""
+        self.search_id = 0
+        self.search_started = None
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.config["search_debounce_ms"])
+        self.search_timer.timeout.connect(self.submit_search)
 
         # setup GUI
 
         self.old_sizes = self.splitter.sizes()
         self.parent().resize(*self.config["window_size"])
 
-        if self.data:
-            self.list1.setCurrentRow(0)
-            self.list1.setFocus()
-
         self.overlay = Overlay(self)
         self.overlay.hide()
         self.setObjectName("mainframe")
 
         self.setFocusPolicy(Qt.StrongFocus)
 
+        # file events are collected and applied in batches
         self.fileWatcher = watchdog.observers.Observer()
-        watcher = FileChangeWatcher()
-        self.fileWatcher.schedule(watcher, path=os.getcwd(), recursive=False)
-        watcher.signal_deleted.connect(self.file_deleted)
-        watcher.signal_modified.connect(self.file_modified)
-        watcher.signal_added.connect(self.file_added)
-        self.fileWatcher.start()
+        watcher = FileChangeWatcher(os.getcwd(), [INDEX_DIRNAME], CONFIG_FILENAME)
+        watcher.signal_config_changed.connect(self.config_changed)
+        self.fileWatcher.schedule(watcher, path=os.getcwd(), recursive=True)
+        self.coalescer = EventCoalescer(self.config["watcher_quiet_ms"], self.config["watcher_max_delay_ms"],
+                                        self.config["watcher_max_batch"], self)
+        self.coalescer.connect_watcher(watcher)
+        self.coalescer.batch_ready.connect(self.files_changed)
+        self.coalescer.overflow.connect(self.reconcile_files)
+
+        # events can get lost, so the directory is compared with data now and then
+        self.reconcile_timer = QTimer(self)
+        self.reconcile_timer.setInterval(self.config["reconcile_interval_ms"])
+        self.reconcile_timer.timeout.connect(self.reconcile_files)
+
+    def config_changed(self):
+        """search weights edited in the config file apply right away"""
+        # the finder is disabled and shows a status while loading and indexing
+        if self.core.reload_config() and self.finder.isEnabled() and len(self.finder.text()) >= 2:
+            self.search_with(self.finder.text())
 
     def remove_from_file_list(self, filename):
-        found_items = self.list1.findItems(filename, Qt.MatchExactly)
-        if len(found_items) != 1:
-            raise RuntimeError("remove_from_file_list(fn={}}): {} found items".format(filename, len(found_items)))
-        self.list1.takeItem(self.list1.row(found_items[0]))
-
-    def file_added(self, filename):
-        # update data
-        try:
-            self.data[filename] = self.load_file(filename)
-        except BadFormatError as e:
-            print(e)
+        self.file_model.remove(filename)
+
+    def current_filename(self):
+        return self.file_model.filename(self.list1.currentRow())
+
+    def files_changed(self, changed, deleted):
+        """batch of file events from the watcher. The files are compared with
+        data (see Headcache.reconcile) and the changed ones parsed on a
+        separate thread, which also updates the index. See files_reparsed()"""
+        self.pending_changed = (self.pending_changed - deleted) | changed
+        self.pending_deleted = (self.pending_deleted - changed) | deleted
+
+        # only one batch at a time, and not while the index writer is in use
+        if self.reparse_thread.isRunning() or self.is_index_busy():
             return
 
-        self.add_file_to_list(filename, self.data[filename]["title"])
-        self.list1.sortItems()
-
-        # update index
-        writer = self.ix.writer()
-        topic = self.data[filename]
-        for part in topic["content"]:
-            writer.add_document(
-                title="",
-                _stored_title=part["title"],
-                content=part["content"],
-                time=topic["time"],
-                path=filename
-            )
-            writer.add_document(
-                title=part["title"],
-                time=topic["time"],
-                path=filename
-            )
-        writer.commit()
-        self.searcher = self.ix.searcher()
-
-    def file_modified(self, filename):
-        # modified event is sometimes fired twice. prevent trouble
-        if filename not in self.data:
-            self.file_added(filename)
-        title_old = self.data[filename]["title"]
-
-        try:
-            self.data[filename] = self.load_file(filename)
-        except BadFormatError as e:
-            print(e)
-            self.file_deleted(filename)
+        filenames = self.pending_changed | self.pending_deleted
+        self.pending_changed, self.pending_deleted = set(), set()
+        changed, deleted, renamed = self.core.reconcile(filenames)
+        if changed or deleted or renamed:
+            self.reparse_thread.begin(self.core, sorted(changed), deleted, renamed)
+
+    def reconcile_files(self):
+        """queues the differences between all files on disk and data"""
+        # the core's data is changed by the reparse thread until it's done
+        if self.reparse_thread.isRunning():
+            self.is_reconcile_pending = True
             return
-        title_new = self.data[filename]["title"]
+        self.is_reconcile_pending = False
+        changed, deleted, renamed = self.core.reconcile()
+        if changed or deleted or renamed:
+            self.files_changed(changed | set(renamed.values()), deleted | set(renamed))
+
+    def files_reparsed(self, changes, entries):
+        """applies a batch of files that the reparse thread applied to the
+        core (see ReparseWorker) to the lists and the html cache"""
+        added, modified, removed, renamed = changes
+        current_filename = self.current_filename()
+        titles_old = {filename: self.data[filename].title for filename in modified}
+        parts_old = self.data[current_filename].sections if current_filename in self.data else []
+        for filename in list(renamed) + removed:
+            self.data.pop(filename, None)
+        self.data.update(entries)
+
+        for filename in added:
+            self.add_file_to_list(filename, self.data[filename].title)
+
+        for old_filename, new_filename in renamed.items():
+            self.html_cache.invalidate(new_filename)
+            self.html_cache.rename(old_filename, new_filename)
+            self.remove_from_file_list(old_filename)
+            if self.file_model.row(new_filename) == -1:
+                self.add_file_to_list(new_filename, self.data[new_filename].title)
+            else:
+                self.file_model.set_title(new_filename, self.data[new_filename].title)
+            if old_filename == current_filename:
+                self.list1.setCurrentRow(self.file_model.row(new_filename))
 
-        # change title in file list if changed
-        if title_old and title_new != title_old:
-            found_items = self.list1.findItems(filename, Qt.MatchExactly)
-            if len(found_items) != 1:
-                raise RuntimeError("file_modified(fn={}}): {} found items".format(filename, len(found_items)))
-            self.list1.itemWidget(found_items[0]).label_title.setText(title_new)
+        for filename in modified:
+            self.html_cache.retain(filename, self.data[filename].sections)
 
+            # change title in file list if changed
+            if self.data[filename].title != titles_old[filename]:
+                self.file_model.set_title(filename, self.data[filename].title)
 
-        # update part list if active file was changed
-        if self.list1.currentItem().text() == filename:
-            old_index = self.list_parts.currentRow()
-            self.update_part_list(filename)
-            self.list_parts.setCurrentRow(old_index)
-
-
-        # update index
-        writer = self.ix.writer()
-        deleted_count = writer.delete_by_term("path", filename)
-
-        topic = self.data[filename]
-        for part in topic["content"]:
-            writer.add_document(
-                title="",
-                _stored_title=part["title"],
-                content=part["content"],
-                time=topic["time"],
-                path=filename
-            )
-            writer.add_document(
-                title=part["title"],
-                time=topic["time"],
-                path=filename
-            )
-        writer.commit()
-        self.searcher = self.ix.searcher()
-
-    def file_deleted(self, filename):
-        # update index
-        writer = self.ix.writer()
-        deleted_count = writer.delete_by_term("path", filename)
-        writer.commit()
-        self.searcher = self.ix.searcher()
-
-        # update internal data
-        del self.data[filename]
-
-        # remove from file list
-        i = -1
-        for i in range(self.list1.count()):
-            item_fn = self.list1.itemWidget(self.list1.item(i)).get_filename()
-            if item_fn == filename:
-                break
-        self.list1.takeItem(self.list1.row(self.list1.item(i)))
+            # update part list if active file was changed
+            if filename == current_filename:
+                self.patch_part_list(parts_old, self.data[filename].sections)
+
+        for filename in removed:
+            self.html_cache.invalidate(filename)
+            self.remove_from_file_list(filename)
+
+        self.search_worker.index_changed()
+        self.update_index_status()
+        self.merge_timer.start()
+
+        # events that came in while this batch was processed, and files that
+        # changed again before they could be indexed
+        self.pending_changed |= self.core.unindexed
+        if self.is_reconcile_pending:
+            self.reconcile_files()
+        if self.pending_changed or self.pending_deleted:
+            self.files_changed(set(), set())
 
     def indexing_finished(self):
         self.finder.setEnabled(True)
-        self.searcher = self.ix.searcher()
+        self.search_worker.index_changed()
         self.parent().statusBar().showMessage('ready')
         self.finder.setText("")
+        self.update_index_status()
+        self.merge_timer.start()
+
+        # files that changed while they were indexed are parsed again
+        self.pending_changed |= self.core.unindexed
+        if self.pending_changed or self.pending_deleted:
+            self.files_changed(set(), set())
+
+    def is_index_busy(self):
+        """whether the index writer is in use by the index or merge thread"""
+        return (self.thread is not None and self.thread.isRunning()) or self.merge_thread.isRunning()
+
+    def start_merge(self):
+        if self.reparse_thread.isRunning() or self.is_index_busy() or self.pending_changed or self.pending_deleted:
+            self.merge_timer.start()
+            return
+        if self.core.needs_merge():
+            self.index_label.setText("merging index...")
+            self.merge_thread.begin(self.core)
+
+    def index_merged(self):
+        self.search_worker.index_changed()
+        self.update_index_status()
+        if self.pending_changed or self.pending_deleted:
+            self.files_changed(set(), set())
+
+    def update_index_status(self):
+        stats = self.core.index.stats()
+        self.index_label.setText("{} segment{}, {:.1f} MB".format(
+            stats["index_segments"], "" if stats["index_segments"] == 1 else "s", stats["index_bytes"] / 1024 ** 2))
+
+    def update_profile_status(self):
+        self.profile_label.setText(profiler.summary(PROFILE_STATUS_STAGES))
 
     def start_indexing(self):
+        # the index is persistent, so this only has to update the files that
+        # changed since the last run
         self.parent().statusBar().showMessage('indexing...')
         self.finder.setText("indexing...")
         self.finder.setEnabled(False)
 
         self.thread = IndexWorker()
         self.thread.finished.connect(self.indexing_finished)
-        writer = self.ix.writer()
-        self.thread.begin(writer, self.data)
+        self.thread.begin(self.core)
+
+    def start_loading(self):
+        self.finder.setText("loading...")
+        self.finder.setEnabled(False)
+
+        self.load_thread = LoadWorker()
+        self.load_thread.batch_loaded.connect(self.files_loaded)
+        self.load_thread.progress.connect(self.loading_progress)
+        self.load_thread.bad_format.connect(print)
+        self.load_thread.finished.connect(self.loading_finished)
+        self.load_thread.begin(self.core)
+
+    def files_loaded(self, batch):
+        for filename, entry in batch:
+            self.core.data[filename] = entry
+            self.data[filename] = entry
+            self.add_file_to_list(filename, entry.title)
+
+        if self.list1.currentRow() == -1 and self.list1.count() > 0:
+            self.list1.setCurrentRow(0)
+            self.list1.setFocus()
+
+    def loading_progress(self, loaded_count, total_count):
+        self.parent().statusBar().showMessage('loading {}/{}'.format(loaded_count, total_count))
+
+    def loading_finished(self):
+        self.core.finish_loading()
+
+        # file events are only handled once the initial data is complete.
+        # Changes while loading are found by comparing the directory
+        self.fileWatcher.start()
+        self.start_indexing()
+        self.reconcile_files()
+        self.reconcile_timer.start()
 
     # immediately before they are shown
     def showEvent(self, event):
         self.old_sizes = self.splitter.sizes()
         self.overlay.setGeometry(QRect(self.finder.pos() + self.finder.rect().bottomLeft(), QSize(400, 200)))
-        QTimer.singleShot(50, self.start_indexing)
+        if not self.is_started:
+            self.is_started = True
+            QTimer.singleShot(0, self.start_loading)
 
     def goto_result(self):
         self.overlay.hide()
         self.finder.setText("")
 
-        filename, part_title = self.overlay.get_selected_indices()
-
-        i_filename = -1
-        for i_filename in range(self.list1.count()):
-            item_fn = self.list1.itemWidget(self.list1.item(i_filename)).get_filename()
-            if item_fn == filename:
-                break
-        self.list1.setCurrentRow(i_filename)
+        filename, section_id = self.overlay.get_selected_indices()
+        row = self.file_model.row(filename)
+        if row == -1:
+            # removed since it was found
+            return
+        self.list1.setCurrentRow(row)
 
-        items = self.list_parts.findItems(part_title, Qt.MatchExactly)
-        self.list_parts.setCurrentItem(items[0])
+        # titles can repeat, the section is found by its key (see
+        # indexing.section_id). If it's gone, the selection stays as it is
+        _, title, occurrence = section_id.rsplit("\n", 2)
+        keys = section_keys(self.data[filename].sections)
+        if (title, int(occurrence)) in keys:
+            self.list_parts.setCurrentRow(keys.index((title, int(occurrence))))
 
         self.view1.setFocus()
 
     @staticmethod
     def load_config():
-        config = {
-            "window_size": [800, 400],
-            "search_title_weight" : 3.0,
-            "search_text_weight": 1.0
-        }
-
-        try:
-            with open('headcache_config.json') as data_file:
-                config.update(json.load(data_file))
-        except FileNotFoundError:
-            pass
-        return config
+        return load_config()
 
     def save_config(self):
         with open("headcache_config.json", "w") as f:
             json.dump(self.config, f, indent=4)
 
-    def load_file(self, filename):
-        file = QFile("{}/{}".format(os.getcwd(), filename))
-        if not file.open(QtCore.QIODevice.ReadOnly):
-            print("couldn't open file")
-        stream = QtCore.QTextStream(file)
-        stream.setCodec("UTF-8")
-        content = stream.readAll()
-
-        # built structure tree
-        self.ast_generator.clear_ast()
-        self.ast_generator.parse(mistune.preprocessing(content), filename=filename)
-        entry = self.ast_generator.ast
-        entry["time"] = QFileInfo(file).lastModified().toMSecsSinceEpoch()
-
-        # add html code to tree nodes
-        for i, lvl2 in enumerate(list(entry["content"])):
-            content_markdown = "##{}\n{}".format(lvl2["title"], lvl2["content"])
-            content_html = self.markdowner_simple(content_markdown)
-            entry["content"][i]["html"] = self.preview_css_str + content_html
-        return entry
-
-    def load_data(self):
-        data = {}
-        for filename in QDir(os.getcwd()).entryList(["*.md"], QDir.Files):
-            try:
-                entry = self.load_file(filename)
-                data[filename] = entry
-            except BadFormatError as e:
-                print(e)
-                continue
-        return data
-        # return {fn: self.load_file(fn) for fn in (QDir(os.getcwd()).entryList(["*.md"], QDir.Files))}
-
     def change_file_title(self, title_new):
-        filename = self.list1.itemWidget(self.list1.currentItem()).get_filename()
-        self.data[filename]["title"] = title_new
+        filename = self.current_filename()
+        self.data[filename].title = title_new
         # self.data[filename] = self.data.pop(filename)
-        self.list1.clear()
-        title_index_dict = self.fill_filename_list()
-        self.list1.setCurrentRow(title_index_dict[title_new])
+        self.file_model.set_title(filename, title_new)
 
         # mark file with changed title as modified
-        self.list1.itemWidget(self.list1.currentItem()).set_modified(True)
+        self.file_model.set_modified(filename, True)
 
     def main_focused(self, *_):
         """hides the search result overlay"""
         self.overlay.hide()
 
-    def file_dclick(self, item):
+    def file_dclick(self, index):
         """opens the file with an external editor"""
-        current_path = QDir.currentPath()
-        filename = self.list1.itemWidget(item).get_filename()
-        QDesktopServices.openUrl(QUrl(u"{}/{}".format(current_path, filename)))
+        filename = self.file_model.filename(index.row())
+        QDesktopServices.openUrl(QUrl.fromLocalFile(os.path.join(os.getcwd(), filename)))
 
     def initUI(self):
         allLayout = QVBoxLayout()
@@ -359,19 +455,27 @@ class MainWidget(QFrame):  # QDialog #QMainWindow
         layout.setContentsMargins(5, 0, 5, 0)
         top_controls.setLayout(layout)
 
+        # all rows have the same height, so only the visible ones are laid out
+        self.file_model = FileListModel(self)
         self.list1 = IndicatorList()
+        self.list1.setModel(self.file_model)
+        self.list1.setItemDelegate(FileListDelegate(self.list1))
+        self.list1.setUniformItemSizes(True)
         self.list1.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
         self.list1.setObjectName("file_list")
-        self.list1.itemDoubleClicked.connect(self.file_dclick)
-
-        self.fill_filename_list()
-
-        self.list1.currentItemChanged.connect(self.file_selected)
+        self.list1.doubleClicked.connect(self.file_dclick)
+        self.list1.selectionModel().currentChanged.connect(self.file_selected)
 
+        self.part_model = QStringListModel(self)
         self.list_parts = IndicatorList()
+        self.list_parts.setModel(self.part_model)
+        self.list_parts.setUniformItemSizes(True)
+        self.list_parts.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.list_parts.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
         self.list_parts.setObjectName("part_list")
-        self.list_parts.model().rowsInserted.connect(self.list_parts_rows_ins)
-        self.list_parts.currentItemChanged.connect(self.list_parts_selected)
+        self.part_model.modelReset.connect(self.list_parts_rows_ins)
+        self.part_model.rowsInserted.connect(self.list_parts_rows_ins)
+        self.list_parts.selectionModel().currentChanged.connect(self.list_parts_selected)
 
         self.list1.setContentsMargins(0, 0, 0, 0)
         self.list1.setMinimumWidth(30)
@@ -385,9 +489,9 @@ class MainWidget(QFrame):  # QDialog #QMainWindow
         self.view1.setOpenExternalLinks(True)
         self.view1.setObjectName("preview")
 
-        self.list1.focusInEvent = self.main_focused
-        self.list_parts.focusInEvent = self.main_focused
-        self.view1.focusInEvent = self.main_focused
+        self.list1.focused.connect(self.main_focused)
+        self.list_parts.focused.connect(self.main_focused)
+        self.view1.focused.connect(self.main_focused)
 
         self.splitter = QSplitter()
         self.splitter.setObjectName("splitter_lists_working")
@@ -407,19 +511,8 @@ class MainWidget(QFrame):  # QDialog #QMainWindow
         self.setLayout(allLayout)
 
     def add_file_to_list(self, filename, title):
-        item = QListWidgetItem(filename, parent=self.list1)
-        item_widget = FileListItemWidget(title, filename)
-        item.setSizeHint(item_widget.sizeHint())
-        self.list1.addItem(item)
-        self.list1.setItemWidget(item, item_widget)
-
-    def fill_filename_list(self):
-        title_index_dict = {}
-        for i, (filename, topic) in enumerate(sorted(self.data.items(), key=lambda k: k[1]["title"])):
-            self.add_file_to_list(filename, topic["title"])
-            title_index_dict[topic["title"]] = i
-        self.list1.sortItems()
-        return title_index_dict
+        """inserts the file at its sorted position"""
+        self.file_model.insert(filename, title)
 
     def splitter_moved(self, pos, handle_index):
         if handle_index == 1:
@@ -432,38 +525,76 @@ class MainWidget(QFrame):  # QDialog #QMainWindow
 
         self.old_sizes = self.splitter.sizes()
 
+    def render_section(self, filename, part):
+        # the core's entry can be newer than the one the part is from
+        return self.core.render_section(filename, part, self.data[filename])
+
     def update_preview(self):
-        filename = self.list1.itemWidget(self.list1.currentItem()).get_filename()
-        html = self.data[filename]["content"][self.list_parts.currentRow()]["html"]
-        self.view1.setHtml(html)
+        filename = self.current_filename()
+        index = self.list_parts.currentRow()
+        html = self.html_cache.get(filename, self.data[filename].sections[index])
+        self.view1.setHtml(self.preview_css_str + html)
 
-    def update_part_list(self, filename):
-        part_names = [part["title"] for part in self.data[filename]["content"]]
-        self.list_parts.clear()
-        self.list_parts.addItems(part_names)
-        self.list_parts.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
+        # render the neighbouring sections once the event loop is idle
+        QTimer.singleShot(0, lambda: self.prerender_sections(filename, [index - 1, index + 1]))
 
-    def file_selected(self, list_widget_item):
-        is_cleared = list_widget_item is None
+    def prerender_sections(self, filename, indices):
+        if filename not in self.data:
+            return
+        parts = self.data[filename].sections
+        for index in indices:
+            if 0 <= index < len(parts) and self.html_cache.key(filename, parts[index]) not in self.html_cache:
+                self.html_cache.get(filename, parts[index])
+
+    def update_part_list(self, filename):
+        part_names = [part.title for part in self.data[filename].sections]
+        self.part_model.setStringList(part_names)
+
+    def patch_part_list(self, parts_old, parts_new):
+        """changes the part list from parts_old to parts_new by inserting and
+        removing only the rows of sections that were added or removed. The
+        selection stays on the same section if it still exists"""
+        old_index = self.list_parts.currentRow()
+        # rows of the model and sections in data don't line up until done
+        self.is_patching_parts = True
+        matcher = difflib.SequenceMatcher(None, section_keys(parts_old), section_keys(parts_new), autojunk=False)
+        for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+            if tag == "equal":
+                continue
+            if i2 > i1:
+                self.part_model.removeRows(i1, i2 - i1)
+            if j2 > j1:
+                self.part_model.insertRows(i1, j2 - j1)
+                for offset, part in enumerate(parts_new[j1:j2]):
+                    self.part_model.setData(self.part_model.index(i1 + offset), part.title)
+        self.is_patching_parts = False
+
+        if self.list_parts.currentRow() == -1 and self.list_parts.count() > 0:
+            self.list_parts.setCurrentRow(min(max(old_index, 0), self.list_parts.count() - 1))
+        elif self.list_parts.currentRow() != -1:
+            # the content of the selected section might have changed
+            self.update_preview()
+
+    def file_selected(self, current, previous):
+        is_cleared = not current.isValid()
 
         if not is_cleared:
-            filename = self.list1.itemWidget(list_widget_item).get_filename()
+            filename = self.file_model.filename(current.row())
             self.update_part_list(filename)
 
     def list_parts_rows_ins(self):
-        if self.list_parts.count() > 0:
+        if self.list_parts.count() > 0 and self.list_parts.currentRow() == -1:
             self.list_parts.setCurrentRow(0)
 
     def list_parts_selected(self, curr, prev):
-        filename = self.list1.itemWidget(self.list1.currentItem()).get_filename()
-        # print(self.list1.itemWidget(self.list1.currentItem()).get_filename(), self.list1.itemWidget(curr).get_filename())
+        if self.is_patching_parts:
+            return
+        filename = self.current_filename()
         if self.list_parts.currentRow() != -1:
-            current_item = self.list_parts.currentItem()
-            if current_item:
-                source_string = self.data[filename]["content"][self.list_parts.currentRow()]["content"]
-
+            if filename is not None:
                 # old_state = self.editor1.blockSignals(True)
-                # self.editor1.setPlainText(source_string)
+                # part = self.data[filename].sections[self.list_parts.currentRow()]
+                # self.editor1.setPlainText(self.core.section_text(filename, self.data[filename], part))
                 self.update_preview()
                 # self.editor1.blockSignals(old_state)
 
@@ -472,52 +603,39 @@ class MainWidget(QFrame):  # QDialog #QMainWindow
             self.config["window_size"] = [self.parent().size().width(), self.parent().size().height()]
 
     def closeEvent(self, *args, **kwargs):
-        self.fileWatcher.stop()
-        self.fileWatcher.join()
+        if self.load_thread is not None and self.load_thread.isRunning():
+            self.load_thread.requestInterruption()
+            self.load_thread.wait()
+        if self.fileWatcher.is_alive():
+            self.fileWatcher.stop()
+            self.fileWatcher.join()
+        self.reconcile_timer.stop()
+        self.merge_timer.stop()
+        self.merge_thread.wait()
+        self.reparse_thread.wait()
+        self.search_worker.stop()
+        self.profile_timer.stop()
         self.save_config()
+        self.core.parse_cache.save()
+        profiler.dump(os.getcwd())
 
-    @staticmethod
-    def highlight_keyword(text, keyword, len_max=60):
-        keyword_sane = keyword.strip().lower()
-        i_begin = text.lower().find(keyword_sane)
-        i_end = i_begin + len(keyword_sane)
-
-        # max length the text before and after the keyword can have
-        len_context = (len_max - len(keyword_sane)) // 2
-
-        part_highlight = '<span style="color: rgb(0,0,0); background-color: rgba(255,231,146,220);">{}</span>'.format(
-            text[i_begin:i_end])
-
-        # trim context strings if too long
-        part_start = text[:i_begin]
-        if len(part_start) > len_context:
-            part_start = "..." + part_start[len(part_start)-len_context:]
-
-        part_end = text[i_end:]
-        if len(part_end) > len_context:
-            part_end = part_end[:len_context] + "..."
+    def search_with(self, text):
+        """searches after the query didn't change for search_debounce_ms"""
+        self.search_text = text
+        self.search_timer.start()
 
-        return part_start + part_highlight + part_end
+    def submit_search(self):
+        self.search_id = self.search_worker.submit(self.search_text)
+        self.search_started = profiler.start()
 
-    def search_with(self, text):
-        parser = MultifieldParser(["title", "content"], self.ix.schema)
-        query = parser.parse("{}".format(text))
-        results = self.searcher.search(query)
-
-        search_results = []
-        for i, result in enumerate(results):
-            if "content" in result:
-                high_content = self.highlight_keyword(result["content"], text).replace("\n", "<br>")
-                html = "<b>{}</b><br>{}".format(result["title"], high_content)
-            else:
-                # highl_title = result.highlights("title", text=result["title"])
-                highl_title = self.highlight_keyword(result["title"], text, len_max=80)
-                html = "<h4>{}</h4>".format(highl_title)
-            html_style = "<style>color: red</style>"
-            search_results.append((html_style+html, result["path"], result["title"]))
-
-        self.overlay.set_search_results(search_results)
-        self.overlay.update_visibility()
+    def search_finished(self, query_id, search_results):
+        # results of outdated queries are ignored
+        if query_id != self.search_id:
+            return
+        with profiler.stage("show_results"):
+            self.overlay.set_search_results(search_results)
+        self.overlay.update_visibility(len(self.finder.text()) >= 2)
+        profiler.stop("search_with", self.search_started)
 
     def keyPressEvent(self, e):
         if e.key() == Qt.Key_Escape:
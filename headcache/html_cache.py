@@ -0,0 +1,60 @@
+import collections
+import sys
+
+
+class HtmlCache:
+    """LRU cache of rendered section html, bounded by the memory size of the
+    cached strings. Sections are rendered on first access and keyed by their
+    hash, so sections that didn't change in an edited file stay cached"""
+
+    def __init__(self, render, max_bytes):
+        # render(filename, part) -> html, None if it can't be rendered now
+        self.render = render
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.entries = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def key(self, filename, part):
+        return filename, part.hash
+
+    def get(self, filename, part):
+        """html of the parsed section part of filename, rendered if it's not
+        cached yet. Empty if the file changed since it was parsed, which is
+        not cached: it's shown once the file is parsed again"""
+        key = self.key(filename, part)
+        html = self.entries.get(key)
+        if html is not None:
+            self.entries.move_to_end(key)
+            return html
+
+        html = self.render(filename, part)
+        if html is None:
+            return ""
+        self.entries[key] = html
+        self.size_bytes += sys.getsizeof(html)
+        self.evict()
+        return html
+
+    def evict(self):
+        # the most recent entry is always kept, even if it's too big by itself
+        while self.size_bytes > self.max_bytes and len(self.entries) > 1:
+            _, html = self.entries.popitem(last=False)
+            self.size_bytes -= sys.getsizeof(html)
+
+    def invalidate(self, filename):
+        """drops all sections of filename, e.g. after it changed"""
+        for key in [key for key in self.entries if key[0] == filename]:
+            self.size_bytes -= sys.getsizeof(self.entries.pop(key))
+
+    def retain(self, filename, parts):
+        """drops the sections of filename that are not in parts anymore"""
+        keys = {self.key(filename, part) for part in parts}
+        for key in [key for key in self.entries if key[0] == filename and key not in keys]:
+            self.size_bytes -= sys.getsizeof(self.entries.pop(key))
+
+    def rename(self, old_filename, new_filename):
+        for key in [key for key in self.entries if key[0] == old_filename]:
+            self.entries[(new_filename, key[1])] = self.entries.pop(key)
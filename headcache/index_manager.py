@@ -0,0 +1,291 @@
+import concurrent.futures
+import heapq
+import itertools
+import os
+import os.path
+import time
+
+from whoosh import scoring
+from whoosh.writing import NO_MERGE, OPTIMIZE
+from whoosh.reading import SegmentReader
+
+from .indexing import open_index, sync_index, VERSION_FILENAME
+from .profiling import profiler
+
+SHARDS_DIRNAME = "shards"
+
+
+def merge_small(writer, segments):
+    """whoosh merge policy: all segments except the biggest one are merged
+    into a new one"""
+    if len(segments) < 2:
+        return segments
+    biggest = max(segments, key=lambda segment: segment.doc_count_all())
+    for segment in segments:
+        if segment is not biggest:
+            reader = SegmentReader(writer.storage, writer.schema, segment)
+            writer.add_reader(reader)
+            reader.close()
+    return [biggest]
+
+
+class RecencyWeighting(scoring.BM25F):
+    """whoosh's default BM25F, with scores multiplied by
+    1 + recency_weight * 0.5 ** (age / half life) when recency_weight is set.
+    The age is that of the section: the mtime of its file when it was last
+    indexed, from the "time" column. One per searcher, as it keeps the column
+    reader of the searcher's reader"""
+
+    def __init__(self, ranking):
+        super().__init__()
+        self.ranking = ranking
+        self.reader = None
+        self.times = None
+
+    @property
+    def use_final(self):
+        # final() makes whoosh score every match, so only when needed
+        return self.ranking.recency_weight > 0
+
+    def final(self, searcher, docnum, score):
+        reader = searcher.reader()
+        if reader is not self.reader:
+            self.times = reader.column_reader("time")
+            self.reader = reader
+        age = max(0.0, time.time() - self.times[docnum])
+        return score * (1 + self.ranking.recency_weight * 0.5 ** (age / self.ranking.half_life))
+
+
+def shard_key(path):
+    """notes are sharded by their top level directory, "" for the notes at
+    the top"""
+    return path.split("/", 1)[0] if "/" in path else ""
+
+
+def shard_dirname(key):
+    return "sub_" + key if key else "root"
+
+
+def shard_key_from_dirname(dirname):
+    return dirname[len("sub_"):] if dirname.startswith("sub_") else ""
+
+
+class Shard:
+    """one whoosh index with its searcher.
+
+    Commits don't merge segments, so saving a file stays fast. Instead the
+    small segments they leave behind are merged by merge(), which the GUI
+    runs on a thread when there were no changes for a while. The searcher is
+    refreshed after changes, which closes the readers of segments that are
+    gone. It scores with the shared ranking, which can change while it's open"""
+
+    def __init__(self, dirname, config, ranking):
+        self.ix = open_index(dirname, config)
+        self.ranking = ranking
+        self.max_segments = config["index_max_segments"]
+        self.max_deleted_ratio = config["index_max_deleted_ratio"]
+        self.searcher = None
+        self.is_changed = False
+
+    def writer(self):
+        return self.ix.writer()
+
+    def changed(self):
+        """the searcher is refreshed before it's used next"""
+        self.is_changed = True
+
+    def get_searcher(self):
+        if self.searcher is None:
+            self.searcher = self.ix.searcher(weighting=RecencyWeighting(self.ranking))
+        elif self.is_changed:
+            self.searcher = self.searcher.refresh()
+        self.is_changed = False
+        return self.searcher
+
+    def close_searcher(self):
+        if self.searcher is not None:
+            self.searcher.close()
+            self.searcher = None
+
+    # segments
+
+    def segments(self):
+        return self.ix._segments()
+
+    def deleted_count(self):
+        return sum(segment.deleted_count() for segment in self.segments())
+
+    def deleted_ratio(self):
+        doc_count = sum(segment.doc_count_all() for segment in self.segments())
+        if doc_count == 0:
+            return 0.0
+        return self.deleted_count() / doc_count
+
+    def needs_merge(self):
+        # merge_small leaves two segments
+        return len(self.segments()) > 2 or self.deleted_ratio() > self.max_deleted_ratio
+
+    def merge(self):
+        """merges the small segments into one. Everything is merged into a
+        single segment (dropping deleted documents) once there are more than
+        index_max_segments segments or too many deleted documents"""
+        if len(self.segments()) > self.max_segments or self.deleted_ratio() > self.max_deleted_ratio:
+            mergetype = OPTIMIZE
+        else:
+            mergetype = merge_small
+        writer = self.ix.writer()
+        writer.commit(mergetype=mergetype)
+        self.changed()
+
+    def size_bytes(self):
+        storage = self.ix.storage
+        return sum(storage.file_length(name) for name in storage.list())
+
+
+class ShardWriters:
+    """whoosh writers of an IndexManager, opened for a shard when a file in it
+    is written to. Shards that aren't touched stay as they are"""
+
+    def __init__(self, index):
+        self.index = index
+        self.writers = {}
+
+    def __call__(self, path):
+        """the writer for the shard of path"""
+        key = shard_key(path)
+        writer = self.writers.get(key)
+        if writer is None:
+            writer = self.writers[key] = self.index.shard(key).writer()
+        return writer
+
+    def commit(self):
+        for key, writer in self.writers.items():
+            with profiler.stage("commit"):
+                writer.commit(mergetype=NO_MERGE)
+            self.index.shards[key].changed()
+        self.writers = {}
+
+    def cancel(self):
+        for writer in self.writers.values():
+            writer.cancel()
+        self.writers = {}
+
+
+class IndexManager:
+    """the search index of a Headcache: one Shard per top level directory,
+    below dirname/shards. Searches run on all shards in parallel"""
+
+    def __init__(self, dirname, config, ranking):
+        self.dirname = dirname
+        self.config = config
+        self.ranking = ranking
+        self.shards = {}
+        self.executor = None
+
+        self.remove_unsharded_index()
+        shards_dirname = os.path.join(dirname, SHARDS_DIRNAME)
+        if os.path.isdir(shards_dirname):
+            for name in sorted(os.listdir(shards_dirname)):
+                if os.path.isdir(os.path.join(shards_dirname, name)):
+                    self.shard(shard_key_from_dirname(name))
+        # the root shard always exists
+        self.shard("")
+
+    def remove_unsharded_index(self):
+        """removes the files of an index written before sharding"""
+        if not os.path.exists(os.path.join(self.dirname, VERSION_FILENAME)):
+            return
+        for name in os.listdir(self.dirname):
+            if name.startswith(("_MAIN_", "MAIN_")) or name == VERSION_FILENAME:
+                os.remove(os.path.join(self.dirname, name))
+
+    def shard(self, key):
+        """the shard for key, created if it doesn't exist yet"""
+        shard = self.shards.get(key)
+        if shard is None:
+            dirname = os.path.join(self.dirname, SHARDS_DIRNAME, shard_dirname(key))
+            os.makedirs(dirname, exist_ok=True)
+            shard = self.shards[key] = Shard(dirname, self.config, self.ranking)
+        return shard
+
+    def writer(self):
+        return ShardWriters(self)
+
+    def commit(self, writers):
+        writers.commit()
+
+    def changed(self):
+        for shard in self.shards.values():
+            shard.changed()
+
+    def sync(self, data, file_text):
+        """updates every shard for the files of data in it, see
+        indexing.sync_index. Returns (number of updated files, skipped
+        filenames)"""
+        shard_data = {}
+        for path, topic in data.items():
+            shard_data.setdefault(shard_key(path), {})[path] = topic
+
+        updated = 0
+        stale = []
+        for key in sorted(set(self.shards) | set(shard_data)):
+            writer = self.shard(key).writer()
+            shard_updated, shard_stale = sync_index(writer, shard_data.get(key, {}), file_text)
+            if shard_updated:
+                with profiler.stage("commit"):
+                    writer.commit(mergetype=NO_MERGE)
+                self.shards[key].changed()
+            else:
+                writer.cancel()
+            updated += shard_updated
+            stale.extend(shard_stale)
+        return updated, stale
+
+    def search(self, search_shard, limit):
+        """runs search_shard(key, searcher), which returns hits with a
+        "score", for every shard and merges the hits by score. With several
+        shards they are searched on a thread pool (search_threads)"""
+        searchers = [(key, shard.get_searcher()) for key, shard in sorted(self.shards.items())]
+        if len(searchers) <= 1:
+            results = [search_shard(key, searcher) for key, searcher in searchers]
+        else:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.config["search_threads"])
+            results = self.executor.map(lambda item: search_shard(*item), searchers)
+        return heapq.nlargest(limit, itertools.chain.from_iterable(results), key=lambda hit: hit["score"])
+
+    def close_searcher(self):
+        for shard in self.shards.values():
+            shard.close_searcher()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    # segments
+
+    def segments(self):
+        return [segment for shard in self.shards.values() for segment in shard.segments()]
+
+    def needs_merge(self):
+        return any(shard.needs_merge() for shard in self.shards.values())
+
+    def merge(self):
+        """merges the segments of the shards that need it, see Shard.merge.
+        Returns the number of segments before and after"""
+        segment_count = len(self.segments())
+        for shard in self.shards.values():
+            if shard.needs_merge():
+                shard.merge()
+        return segment_count, len(self.segments())
+
+    def stats(self):
+        shards = self.shards.values()
+        doc_count_all = sum(segment.doc_count_all() for segment in self.segments())
+        deleted_count = sum(shard.deleted_count() for shard in shards)
+        return {
+            "index_shards": len(self.shards),
+            "index_documents": sum(shard.ix.doc_count() for shard in shards),
+            "index_segments": len(self.segments()),
+            "index_deleted_ratio": deleted_count / doc_count_all if doc_count_all else 0.0,
+            "index_bytes": sum(shard.size_bytes() for shard in shards)
+        }
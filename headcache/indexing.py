@@ -0,0 +1,155 @@
+import json
+import os
+import os.path
+
+from whoosh.fields import Schema, TEXT, ID, KEYWORD, NUMERIC, STORED
+from whoosh.index import create_in, open_dir, exists_in
+
+from .engines import get_engine
+from .loader import section_keys
+
+# bump whenever the schema or the way documents are written changes. A
+# mismatch with the version stored next to the index forces a full rebuild
+SCHEMA_VERSION = 6
+VERSION_FILENAME = "headcache_version.json"
+
+
+def create_schema(config):
+    """the content of sections is not stored, it's read from the files (see
+    TextCache). Field weights are applied when searching (see ranking.py),
+    time (mtime in seconds) is a column for the recency boost. The character
+    offsets of the terms are stored for the snippets (see snippets.py)"""
+    analyzer_typing = get_engine(config["search_engine"]).analyzer()
+    return Schema(
+        title=TEXT(stored=True, analyzer=analyzer_typing, chars=True),
+        content=TEXT(analyzer=analyzer_typing, chars=True),
+        path=ID(stored=True),
+        section_id=ID(stored=True, unique=True),
+        section_hash=STORED,
+        time=NUMERIC(bits=64, sortable=True),
+        tags=KEYWORD)
+
+
+def index_version(config):
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "search_engine": config["search_engine"]
+    }
+
+
+def open_index(dirname, config):
+    """opens the persistent index in dirname. It is recreated (and therefore
+    fully rebuilt by the next sync) if it doesn't exist or was written with a
+    different schema version or search engine"""
+    if not os.path.exists(dirname):
+        os.mkdir(dirname)
+
+    version_path = os.path.join(dirname, VERSION_FILENAME)
+    try:
+        with open(version_path) as version_file:
+            stored_version = json.load(version_file)
+    except (FileNotFoundError, ValueError):
+        stored_version = None
+
+    version = index_version(config)
+    if stored_version == version and exists_in(dirname):
+        return open_dir(dirname)
+
+    ix = create_in(dirname, create_schema(config))
+    with open(version_path, "w") as version_file:
+        json.dump(version, version_file, indent=4)
+    return ix
+
+
+def section_id(filename, key):
+    """unique id of a section in the index, see loader.section_keys"""
+    title, occurrence = key
+    return "{}\n{}\n{}".format(filename, title, occurrence)
+
+
+def topic_sections(filename, topic):
+    """{section id: section} of a parsed file"""
+    parts = topic.sections
+    return {section_id(filename, key): part for key, part in zip(section_keys(parts), parts)}
+
+
+def add_section(writer, filename, doc_id, part, content, modified):
+    """one document per section, title and content in their own fields.
+    modified is the mtime of the file in seconds"""
+    writer.add_document(
+        title=part.title,
+        content=content,
+        path=filename,
+        section_id=doc_id,
+        section_hash=part.hash,
+        time=modified
+    )
+
+
+class StaleFileError(Exception):
+    """a file changed since it was parsed, so its sections can't be read"""
+
+    def __init__(self, filename):
+        super().__init__("{} changed since it was parsed".format(filename))
+        self.filename = filename
+
+
+def update_topic(writer, filename, indexed, topic, file_text):
+    """writes the difference between the indexed sections of a file
+    ({section id: hash}) and its parsed sections: sections that are gone or
+    changed are deleted, new and changed ones added, with their text sliced
+    from file_text(filename, topic). Returns the number of deleted plus added
+    sections. Raises StaleFileError (before writing anything) if sections
+    have to be added but file_text returns None: their text isn't the one
+    their hash is of"""
+    sections = topic_sections(filename, topic)
+    added = {doc_id: part for doc_id, part in sections.items() if indexed.get(doc_id) != part.hash}
+    text = None
+    if added:
+        text = file_text(filename, topic)
+        if text is None:
+            raise StaleFileError(filename)
+
+    changes = 0
+    for doc_id, indexed_hash in indexed.items():
+        part = sections.get(doc_id)
+        if part is None or part.hash != indexed_hash:
+            writer.delete_by_term("section_id", doc_id)
+            changes += 1
+    for doc_id, part in added.items():
+        add_section(writer, filename, doc_id, part, text[part.start:part.end], topic.time // 1000)
+        changes += 1
+    return changes
+
+
+def indexed_sections(reader):
+    """{path: {section id: hash}} of all sections currently in the index"""
+    sections = {}
+    for fields in reader.all_stored_fields():
+        sections.setdefault(fields["path"], {})[fields["section_id"]] = fields["section_hash"]
+    return sections
+
+
+def sync_index(writer, data, file_text):
+    """brings the index in line with data: documents of removed files are
+    deleted, and for the other files only the sections that were added,
+    changed or removed since they were indexed. Files that changed since they
+    were parsed are left as they are, they're indexed once they're parsed
+    again. Returns (number of files that needed changes, skipped filenames)"""
+    with writer.reader() as reader:
+        indexed = indexed_sections(reader)
+
+    updated = 0
+    for filename in indexed:
+        if filename not in data:
+            writer.delete_by_term("path", filename)
+            updated += 1
+
+    stale = []
+    for filename, topic in sorted(data.items(), key=lambda k: k[1].title):
+        try:
+            if update_topic(writer, filename, indexed.get(filename, {}), topic, file_text):
+                updated += 1
+        except StaleFileError:
+            stale.append(filename)
+    return updated, stale
@@ -0,0 +1,162 @@
+import collections
+import concurrent.futures
+import hashlib
+import os
+import os.path
+import threading
+import time
+
+import mistune
+
+from .md_parser import AstBlockParser, BadFormatError
+from .notes import Note, Section
+from .profiling import profiler
+
+# below this many files the startup cost of a pool outweighs the gain
+MIN_PARALLEL_FILES = 16
+
+# parser and renderer are stateful, so each process and thread gets its own
+_tools_local = threading.local()
+
+
+class IdRenderer(mistune.Renderer):
+    def header(self, text, level, raw):
+        return '<h{0} id="{1}">{1}</h{0}>\n'.format(level, text)
+
+
+def _tools():
+    if not hasattr(_tools_local, "ast_generator"):
+        _tools_local.ast_generator = AstBlockParser()
+        _tools_local.markdowner_simple = mistune.Markdown(renderer=IdRenderer())
+    return _tools_local.ast_generator, _tools_local.markdowner_simple
+
+
+def stat_stamp(stat):
+    """(mtime in ms, size, inode) of an os.stat result"""
+    return stat.st_mtime_ns // 1000000, stat.st_size, stat.st_ino
+
+
+def file_stamp(path):
+    return stat_stamp(os.stat(path))
+
+
+def entry_stamp(entry):
+    """file_stamp of the file a parsed entry (a notes.Note) was read from"""
+    return entry.time, entry.size, entry.inode
+
+
+def read_note(path):
+    """content of a note file, unchanged (line endings included) so its hash
+    is that of the bytes on disk"""
+    with open(path, encoding="utf-8", newline="") as file:
+        return file.read()
+
+
+def note_hash(content):
+    return hashlib.sha1(content.encode("utf-8")).digest()
+
+
+def parse_file(directory, filename, timings=None):
+    """reads and parses a single file into a notes.Note. Raises
+    BadFormatError. The duration of parsing is put into timings if given"""
+    path = os.path.join(directory, filename)
+    # stamp before reading: if the file changes in between, the stamp is
+    # outdated rather than the content
+    stamp = file_stamp(path)
+    content = read_note(path)
+    ast_generator, _ = _tools()
+
+    # built structure tree
+    text = mistune.preprocessing(content)
+    ast_generator.clear_ast()
+    if timings is None:
+        ast_generator.parse(text, filename=filename)
+    else:
+        t0 = time.perf_counter()
+        ast_generator.parse(text, filename=filename)
+        timings["parse"] = time.perf_counter() - t0
+    ast = ast_generator.ast
+    if "title" not in ast:
+        raise BadFormatError(filename, "no lvl1 heading")
+
+    # the section texts are sliced from text again when needed, see TextCache
+    sections = []
+    for part in ast["content"]:
+        section_text = text[part["start"]:part["end"]]
+        sections.append(Section(part["title"], part["start"], part["end"], section_hash(part["title"], section_text)))
+    return Note(ast["title"], sections, *stamp, note_hash(content))
+
+
+def section_hash(title, content):
+    return hashlib.sha1("{}\n{}".format(title, content).encode("utf-8")).digest()
+
+
+def section_keys(parts):
+    """identity of each section: its title and the number of sections with
+    the same title before it. Unlike the position it doesn't change when other
+    sections are added or removed"""
+    counts = collections.Counter()
+    keys = []
+    for part in parts:
+        keys.append((part.title, counts[part.title]))
+        counts[part.title] += 1
+    return keys
+
+
+def render_section(title, content):
+    """html of a h2 section. Rendering is done on demand, see HtmlCache"""
+    _, markdowner_simple = _tools()
+    content_markdown = "##{}\n{}".format(title, content)
+    return markdowner_simple(content_markdown)
+
+
+def _load_one(directory, filename, is_timed=False):
+    """(filename, entry, error, timings). Workers in other processes can't
+    record their timings themselves, so they are returned"""
+    timings = {} if is_timed else None
+    t0 = time.perf_counter()
+    # files can disappear between being listed and being read
+    try:
+        entry = parse_file(directory, filename, timings)
+    except (BadFormatError, OSError) as e:
+        return filename, None, e, timings
+    if is_timed:
+        timings["load_file"] = time.perf_counter() - t0
+    return filename, entry, None, timings
+
+
+def iter_load(directory, filenames, workers=1, executor="process"):
+    """parses filenames and yields (filename, entry, error) tuples in the order
+    they finish. Either entry or error (a BadFormatError or OSError) is None.
+
+    workers > 1 spreads the files over a process or thread pool (executor is
+    "process" or "thread"), workers == 0 uses one worker per cpu"""
+    for filename, entry, error, timings in _iter_load(directory, filenames, workers, executor, profiler.enabled):
+        if timings:
+            profiler.add_all(timings)
+        yield filename, entry, error
+
+
+def _iter_load(directory, filenames, workers, executor, is_timed):
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    if workers == 1 or len(filenames) < MIN_PARALLEL_FILES:
+        for filename in filenames:
+            yield _load_one(directory, filename, is_timed)
+        return
+
+    if executor == "thread":
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    else:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    futures = []
+    try:
+        futures = [pool.submit(_load_one, directory, filename, is_timed) for filename in filenames]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+    finally:
+        # when closed early (the window is closed while loading), only the
+        # files that are being parsed right now are waited for
+        for future in futures:
+            future.cancel()
+        pool.shutdown()
@@ -1,21 +1,126 @@
+import re
+
 import mistune
 
 class BadFormatError(RuntimeError):
     def __init__(self, filename, text):
+        # passing the arguments on keeps the error picklable, so it can be
+        # sent back from loader processes
+        super().__init__(filename, text)
         self.filename = filename
         self.value = text
     def __str__(self):
         return repr("{}, file: {}".format(self.value, self.filename))
 
 class AstBlockParser(mistune.BlockLexer):
-    def __init__(self, rules=None, **kwargs):
+    # block rules without their leading "^", so they can be matched at an
+    # offset. Shared between instances, keyed by the original pattern
+    _offset_rules = {}
+
+    def __init__(self, rules=None, linear=True, **kwargs):
+        """linear=False selects the original parser that re-slices the text
+        after every block (quadratic in the file size)"""
         self.ast = {}
+        self.linear = linear
+        self._section_chunks = None
+        self._matchers = {}
         super().__init__(rules, **kwargs)
 
     def clear_ast(self):
         self.ast = {}
 
     def parse(self, text, rules=None, filename=None):
+        if self.linear:
+            return self.parse_linear(text, rules, filename)
+        return self.parse_sliced(text, rules, filename)
+
+    def offset_rule(self, key):
+        rule = getattr(self.rules, key)
+        offset_rule = self._offset_rules.get(rule.pattern)
+        if offset_rule is None:
+            offset_rule = re.compile(mistune._pure_pattern(rule), rule.flags)
+            self._offset_rules[rule.pattern] = offset_rule
+        return offset_rule
+
+    def matchers(self, rules):
+        """(key, match function, parse method) for each rule"""
+        rules = tuple(rules)
+        matchers = self._matchers.get(rules)
+        if matchers is None:
+            matchers = [(key, self.offset_rule(key).match, getattr(self, 'parse_%s' % key)) for key in rules]
+            self._matchers[rules] = matchers
+        return matchers
+
+    def parse_linear(self, text, rules=None, filename=None):
+        """same result as parse_sliced(), but matches the rules at an offset
+        instead of slicing the text and collects the content of each section
+        as a list of chunks that is joined once at the end. Sections also get
+        the "start" and "end" of their content in text"""
+        text = text.rstrip('\n')
+
+        if not rules:
+            rules = self.default_rules
+
+        # nested calls (block quotes, lists) add to the chunks of the outermost
+        is_outermost = self._section_chunks is None
+        if is_outermost:
+            self._section_chunks = []
+
+        is_list = rules == self.list_rules
+        matchers = self.matchers(rules)
+        try:
+            pos = 0
+            end = len(text)
+            while pos < end:
+                for key, match, parse_rule in matchers:
+                    m = match(text, pos)
+                    if not m:
+                        continue
+
+                    section_count = len(self.ast.get("content", ()))
+                    parse_rule(m)
+
+                    if key != "heading" and "title" not in self.ast:
+                        raise BadFormatError(filename, "content without lvl1 heading")
+
+                    if key not in ["heading", "newline"] and len(self.ast["content"]) == 0:
+                        raise BadFormatError(filename, "content under lvl1 heading")
+
+                    # see parse_sliced()
+                    if key != "heading" and not is_list:
+                        self._section_chunks[-1].append(m.group(0))
+                    if is_outermost:
+                        self.set_offsets(m, key == "heading", section_count)
+                    pos = m.end()
+                    break
+                else:  # pragma: no cover
+                    raise RuntimeError('Infinite loop at: %s' % text[pos:])
+        finally:
+            if is_outermost:
+                for section, chunks in zip(self.ast.get("content", []), self._section_chunks):
+                    section["content"] = "".join(chunks)
+                if self.ast.get("content"):
+                    self.ast["content"][-1]["end"] = len(text)
+                self._section_chunks = None
+        return self.tokens
+
+    def set_offsets(self, m, is_heading, section_count):
+        """sets "start" and "end" of the sections that began with the block m
+        of the outermost text, and the "end" of the one before them. The
+        content of a section starts after its heading and ends where the next
+        section starts. A section started by a nested heading (in a block
+        quote) gets the whole block"""
+        sections = self.ast.get("content", [])
+        if len(sections) == section_count:
+            return
+        if section_count > 0:
+            sections[section_count - 1]["end"] = m.start()
+        for section in sections[section_count:]:
+            section["start"] = section["end"] = m.start()
+        if is_heading:
+            sections[-1]["start"] = m.end()
+
+    def parse_sliced(self, text, rules=None, filename=None):
         text = text.rstrip('\n')
 
         if not rules:
@@ -74,8 +179,14 @@ class AstBlockParser(mistune.BlockLexer):
                 "title": text,
                 "content": self.get_content(m.group(0))
             })
+            if self._section_chunks is not None:
+                self._section_chunks.append([self.ast["content"][-1]["content"]])
         else:
-            self.ast["content"][-1]["content"] += m.group(0)
+            section = self.ast["content"][-1]
+            if self._section_chunks is not None:
+                self._section_chunks[-1].append(m.group(0))
+            else:
+                section["content"] += m.group(0)
 
         super().parse_heading(m)
 
@@ -0,0 +1,28 @@
+"""compact records of parsed notes. A section doesn't keep its markdown, only
+where it is in the preprocessed text of its file (see TextCache)"""
+
+
+class Section:
+    """a h2 section. start and end are character offsets into the text of
+    the file after mistune.preprocessing"""
+    __slots__ = ("title", "start", "end", "hash")
+
+    def __init__(self, title, start, end, hash):
+        self.title = title
+        self.start = start
+        self.end = end
+        self.hash = hash
+
+
+class Note:
+    """a parsed file: its h1 title, sections and the stamp and hash of the
+    file it was parsed from"""
+    __slots__ = ("title", "sections", "time", "size", "inode", "hash")
+
+    def __init__(self, title, sections, time, size, inode, hash):
+        self.title = title
+        self.sections = sections
+        self.time = time
+        self.size = size
+        self.inode = inode
+        self.hash = hash
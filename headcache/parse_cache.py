@@ -0,0 +1,111 @@
+import os
+import pickle
+import zlib
+
+MAGIC = b"HCPC"
+# bump when the layout of the parsed entries changes
+CACHE_VERSION = 7
+
+
+class ParseCache:
+    """on-disk cache of parsed files (notes.Note records), so unchanged
+    files don't have to go through mistune at startup.
+
+    Entries are keyed by filename and only valid for the mtime, size and
+    inode they were stored with. A renamed file is found by its stamp. Each
+    entry is a compressed pickle with a checksum; entries that are stale or
+    don't match their checksum are thrown away, as is the whole cache if it
+    can't be read at all"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        # stamp -> filename, to find renamed files
+        self.filenames = {}
+        self.dirty = False
+
+    def load(self):
+        self.entries = {}
+        try:
+            with open(self.path, "rb") as cache_file:
+                header = cache_file.read(len(MAGIC) + 1)
+                if header != MAGIC + bytes([CACHE_VERSION]):
+                    return
+                self.entries = pickle.load(cache_file)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            # corrupt or truncated cache file. Start from scratch
+            self.entries = {}
+            self.dirty = True
+        finally:
+            self.filenames = {record[0]: filename for filename, record in self.entries.items()}
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        path_tmp = self.path + ".tmp"
+        with open(path_tmp, "wb") as cache_file:
+            cache_file.write(MAGIC + bytes([CACHE_VERSION]))
+            pickle.dump(self.entries, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path_tmp, self.path)
+        self.dirty = False
+
+    def get(self, filename, time, size, inode):
+        """returns the cached entry for filename if it is still valid for the
+        given mtime, size and inode, None otherwise"""
+        record = self.entries.get(filename)
+        if record is None:
+            return None
+
+        cached_stamp, cached_hash, checksum, payload = record
+        if cached_stamp != (time, size, inode) or zlib.crc32(payload) != checksum:
+            self.discard(filename)
+            return None
+        try:
+            entry = pickle.loads(zlib.decompress(payload))
+        except Exception:
+            self.discard(filename)
+            return None
+        if entry.hash != cached_hash:
+            self.discard(filename)
+            return None
+        return entry
+
+    def put(self, filename, entry):
+        payload = zlib.compress(pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL))
+        self.discard(filename)
+        stamp = (entry.time, entry.size, entry.inode)
+        self.entries[filename] = (stamp, entry.hash, zlib.crc32(payload), payload)
+        self.filenames[stamp] = filename
+        self.dirty = True
+
+    def find_moved(self, time, size, inode, exclude):
+        """filename of an entry (not in exclude) for a file with the given
+        stamp, i.e. a file that was renamed. None if there is none"""
+        if not inode:
+            return None
+        filename = self.filenames.get((time, size, inode))
+        return None if filename is None or filename in exclude else filename
+
+    def rename(self, old_filename, new_filename):
+        record = self.entries.get(old_filename)
+        if record is not None:
+            self.discard(old_filename)
+            self.discard(new_filename)
+            self.entries[new_filename] = record
+            self.filenames[record[0]] = new_filename
+            self.dirty = True
+
+    def discard(self, filename):
+        record = self.entries.pop(filename, None)
+        if record is not None:
+            if self.filenames.get(record[0]) == filename:
+                del self.filenames[record[0]]
+            self.dirty = True
+
+    def retain(self, filenames):
+        """drops the entries of all files not in filenames"""
+        for filename in set(self.entries) - set(filenames):
+            self.discard(filename)
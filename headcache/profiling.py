@@ -0,0 +1,183 @@
+"""timing of the stages headcache spends its time in (parsing, rendering,
+indexing, searching, showing results).
+
+Switched on with the "profile" config key or the HEADCACHE_PROFILE
+environment variable (which wins):
+
+    1 / true       rolling percentiles of every stage
+    startup        the same plus a cProfile of loading and indexing at start
+    search:<text>  the same plus a cProfile of the first search for <text>
+
+The percentiles are shown in the status bar and written to
+headcache_profile.json on exit, cProfile captures to headcache_<name>.prof
+(see pstats or snakeviz). Switched off, stage() and start() return right
+away and nothing is recorded"""
+import collections
+import contextlib
+import cProfile
+import json
+import os
+import os.path
+import pstats
+import threading
+import time
+
+ENVIRONMENT_VARIABLE = "HEADCACHE_PROFILE"
+PROFILE_FILENAME = "headcache_profile.json"
+# durations of each stage the percentiles are computed over
+WINDOW = 1000
+
+_disabled_stage = contextlib.nullcontext()
+
+
+class StageTimes:
+    """the last WINDOW durations of a stage, plus count and total of all"""
+
+    def __init__(self):
+        self.durations = collections.deque(maxlen=WINDOW)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, duration):
+        self.durations.append(duration)
+        self.count += 1
+        self.total += duration
+
+    def percentile(self, durations, p):
+        return durations[min(len(durations) - 1, int(round(p / 100 * (len(durations) - 1))))]
+
+    def stats(self):
+        durations = sorted(self.durations)
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "p50_ms": self.percentile(durations, 50) * 1000,
+            "p95_ms": self.percentile(durations, 95) * 1000,
+            "p99_ms": self.percentile(durations, 99) * 1000,
+            "max_ms": durations[-1] * 1000
+        }
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.capture_name = None
+        self.search_text = None
+        self.stages = {}
+        self.captures = collections.defaultdict(list)
+        self.lock = threading.Lock()
+
+    def configure(self, setting):
+        """setting is the "profile" config value, see module doc"""
+        setting = os.environ.get(ENVIRONMENT_VARIABLE, setting)
+        if isinstance(setting, str):
+            setting = setting.strip()
+            if setting.lower() in ("", "0", "false", "no", "off"):
+                setting = False
+        self.enabled = bool(setting)
+        self.capture_name = None
+        self.search_text = None
+        if isinstance(setting, str):
+            if setting == "startup":
+                self.capture_name = "startup"
+            elif setting.startswith("search:"):
+                self.capture_name = "search"
+                self.search_text = setting[len("search:"):]
+
+    # timing
+
+    def start(self):
+        """start time for stop(), None if switched off"""
+        return time.perf_counter() if self.enabled else None
+
+    def stop(self, name, started):
+        if started is not None:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, duration):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = StageTimes()
+            stage.add(duration)
+
+    def add_all(self, durations):
+        """adds {name: duration}"""
+        for name, duration in durations.items():
+            self.add(name, duration)
+
+    @contextlib.contextmanager
+    def _stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def stage(self, name):
+        """context manager that times its block as stage name"""
+        if not self.enabled:
+            return _disabled_stage
+        return self._stage(name)
+
+    def stats(self):
+        with self.lock:
+            return {name: stage.stats() for name, stage in sorted(self.stages.items())}
+
+    def summary(self, names):
+        """compact p50/p95 of the stages names that were timed, for the
+        status bar"""
+        with self.lock:
+            parts = []
+            for name in names:
+                stage = self.stages.get(name)
+                if stage is not None:
+                    durations = sorted(stage.durations)
+                    parts.append("{} {:.1f}/{:.1f} ms".format(
+                        name, stage.percentile(durations, 50) * 1000, stage.percentile(durations, 95) * 1000))
+            return " | ".join(parts)
+
+    # cProfile
+
+    def capture(self, name):
+        """context manager that runs its block under cProfile if name is the
+        selected capture. Blocks of several threads are combined"""
+        if self.capture_name != name:
+            return _disabled_stage
+        return self._capture(name)
+
+    def capture_search(self, text):
+        """capture() for the first search for the selected text"""
+        if self.capture_name != "search" or text != self.search_text:
+            return _disabled_stage
+        self.search_text = None
+        return self._capture("search")
+
+    @contextlib.contextmanager
+    def _capture(self, name):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self.lock:
+                self.captures[name].append(profile)
+
+    def dump(self, directory):
+        """writes the stage stats and captures into directory"""
+        if not self.enabled:
+            return
+        with open(os.path.join(directory, PROFILE_FILENAME), "w") as profile_file:
+            json.dump({"stages": self.stats()}, profile_file, indent=4)
+        with self.lock:
+            captures = dict(self.captures)
+        for name, profiles in captures.items():
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(os.path.join(directory, "headcache_{}.prof".format(name)))
+
+
+# one per process, configured when a Headcache is created
+profiler = Profiler()
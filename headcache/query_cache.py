@@ -0,0 +1,102 @@
+import collections
+import threading
+
+
+class QueryCache:
+    """LRU cache of search hits for recent queries.
+
+    Queries that were searched before (the same text, up to whitespace between
+    plain words) are answered from the cache. While typing, a query usually
+    contains the words of an earlier one (plus a bit more). If that earlier
+    search found all of its matches (fewer hits than the limit), the new hits
+    are among them and can be filtered in memory with the engine's
+    match_fields() instead of searching the index. Narrowed hits keep the
+    order of the earlier search. Only queries that are plain words are
+    narrowed, or narrowed from (see Engine.plain_words): words() doesn't show
+    operators or field:terms.
+
+    Searching runs on its own thread while files are updated on the GUI
+    thread, hence the lock. fields(hit) gives the title and content of a
+    hit, which aren't all stored in the index"""
+
+    def __init__(self, engine, size=64, fields=dict):
+        self.engine = engine
+        self.size = size
+        self.fields = fields
+        # (text, limit) -> (hits, is_complete, is_fuzzy, plain words or None)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, text, limit):
+        # whitespace matters to whoosh around operators ("a NOT" and "a NOT "
+        # are different queries), not between plain words
+        if self.engine.is_plain(text):
+            text = " ".join(text.split())
+        return text, limit
+
+    def get(self, text, limit):
+        """cached or narrowed hits for text, or None"""
+        key = self.key(text, limit)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return list(entry[0])
+
+        words = self.engine.plain_words(text)
+        if words is None or not self.engine.can_narrow(words):
+            return None
+        with self.lock:
+            # the smallest complete result that contains all hits for words
+            best = None
+            for hits, is_complete, _, cached_words in self.entries.values():
+                if (is_complete and cached_words and self.is_narrower(words, cached_words)
+                        and (best is None or len(hits) < len(best))):
+                    best = hits
+        if best is None:
+            return None
+
+        hits = []
+        for hit in best:
+            matched_fields = self.engine.match_fields(words, self.fields(hit))
+            if matched_fields:
+                hit = dict(hit, matched_fields=matched_fields)
+                # the snippets are found again for the new words
+                hit.pop("snippet_windows", None)
+                hits.append(hit)
+        self.put(text, limit, hits[:limit])
+        return hits[:limit]
+
+    @staticmethod
+    def is_narrower(words, cached_words):
+        """whether everything words match also matches cached_words: each
+        cached word is part of one of the new words"""
+        return all(any(cached_word in word for word in words) for cached_word in cached_words)
+
+    def put(self, text, limit, hits, is_fuzzy=False):
+        """hits of a fuzzy search (see Engine.fuzzy_parse) don't contain the
+        words, they're never narrowed"""
+        key = self.key(text, limit)
+        words = self.engine.plain_words(text)
+        with self.lock:
+            self.entries[key] = (list(hits), len(hits) < limit and not is_fuzzy, is_fuzzy, words)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, paths, sections):
+        """drops the queries that found one of paths, or would find one of
+        sections (the new sections of these paths) now. If the engine can't
+        tell, all queries are dropped, as are all fuzzy ones and those that
+        aren't plain words"""
+        paths = set(paths)
+        with self.lock:
+            for key, (hits, _, is_fuzzy, words) in list(self.entries.items()):
+                if (is_fuzzy or words is None or any(hit["path"] in paths for hit in hits)
+                        or not self.engine.can_narrow(words)
+                        or any(self.engine.match_fields(words, part) for part in sections)):
+                    del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,22 @@
+"""how search hits are ranked: weights of title and content and an optional
+boost for recently changed sections. All of it is applied at query time, so
+changing it doesn't need a reindex and is picked up while running (see
+Headcache.reload_config). The scores are computed by the searchers of the
+index (see index_manager.RecencyWeighting), this module doesn't import
+whoosh"""
+
+# the config keys of the ranking
+RANKING_KEYS = ["search_title_weight", "search_text_weight", "search_recency_weight", "search_recency_half_life_days"]
+
+
+class Ranking:
+    """ranking settings shared by the engines and searchers of all shards"""
+
+    def __init__(self, config):
+        self.update(config)
+
+    def update(self, config):
+        self.field_weights = {"title": config["search_title_weight"], "content": config["search_text_weight"]}
+        self.recency_weight = config["search_recency_weight"]
+        self.half_life = config["search_recency_half_life_days"] * 24 * 3600
+
@@ -0,0 +1,100 @@
+"""compares the notes on disk with the loaded ones. File events can get lost
+or arrive in bursts (checking out a branch, a sync client replacing the
+folder, editors saving by renaming), so instead of trusting them the files
+are compared by their stamp (mtime, size, inode). A file that disappeared
+while a new one with its inode appeared was renamed and doesn't have to be
+parsed again"""
+import os
+import os.path
+
+from .loader import stat_stamp, entry_stamp
+
+
+def is_note(path, exclude=()):
+    """whether path (relative, "/" separated) is a note: a *.md file that is
+    not in a hidden directory or one of the top level directories exclude"""
+    parts = path.split("/")
+    return (path.endswith(".md") and parts[0] not in exclude
+            and not any(part.startswith(".") for part in parts[:-1]))
+
+
+def is_note_directory(path, exclude=()):
+    """whether the directory path (relative, "/" separated) can contain
+    notes: it's neither hidden nor in one of the top level directories
+    exclude"""
+    parts = path.split("/")
+    return parts[0] not in exclude and not any(part.startswith(".") and part != "." for part in parts)
+
+
+def iter_notes(directory, exclude=(), prefix=""):
+    """yields (path, os.DirEntry) of all notes below directory. Paths are
+    relative to directory, with "/" as separator on all systems"""
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return
+    for entry in entries:
+        path = prefix + entry.name
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith(".") and not (not prefix and entry.name in exclude):
+                    yield from iter_notes(entry.path, exclude, path + "/")
+            elif entry.name.endswith(".md") and entry.is_file():
+                yield path, entry
+        except OSError:
+            pass
+
+
+def snapshot(directory, exclude=()):
+    """{path: stamp} of all notes below directory"""
+    stamps = {}
+    for path, entry in iter_notes(directory, exclude):
+        try:
+            # DirEntry.stat() has no inode on Windows, DirEntry.inode() has
+            stamps[path] = stat_stamp(entry.stat())[:2] + (entry.inode(),)
+        except OSError:
+            pass
+    return stamps
+
+
+def stat_files(directory, filenames):
+    """{filename: stamp} of the filenames that exist"""
+    stamps = {}
+    for filename in filenames:
+        try:
+            stamps[filename] = stat_stamp(os.stat(os.path.join(directory, filename)))
+        except OSError:
+            pass
+    return stamps
+
+
+def reconcile(stamps, data, filenames=None):
+    """the changes that bring data in line with stamps (see snapshot), for
+    filenames (by default all files in either of them). Returns (changed,
+    deleted, renamed): sets of files to (re)parse and to remove, and {old
+    filename: new filename} of entries to move. Renamed files that also
+    changed are in changed as well"""
+    if filenames is None:
+        filenames = set(stamps) | set(data)
+
+    gone, appeared, changed = [], {}, set()
+    for filename in filenames:
+        stamp = stamps.get(filename)
+        entry = data.get(filename)
+        if stamp is None:
+            if entry is not None:
+                gone.append(filename)
+        elif entry is None or stamp != entry_stamp(entry):
+            changed.add(filename)
+            # renaming onto an existing file changes its stamp, too
+            if stamp[2]:
+                appeared[stamp[2]] = filename
+
+    renamed = {}
+    for filename in sorted(gone):
+        new_filename = appeared.pop(data[filename].inode, None)
+        if new_filename is not None:
+            renamed[filename] = new_filename
+            if stamps[new_filename][:2] == entry_stamp(data[filename])[:2]:
+                changed.discard(new_filename)
+    return changed, set(gone) - set(renamed), renamed
@@ -1,26 +1,133 @@
-import whoosh
-import whoosh.highlight
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QListWidget, QListView, QListWidgetItem
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
-from PyQt5.QtGui import QStandardItemModel, QStandardItem
+import logging
 
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QListView, QStyledItemDelegate, QStyle, QApplication
+from PyQt5.QtCore import (Qt, QThread, QMutex, QMutexLocker, QWaitCondition, pyqtSignal, QAbstractListModel,
+                          QModelIndex, QSize, QRectF)
+from PyQt5.QtGui import QTextDocument, QAbstractTextDocumentLayout, QPalette, QColor
 
-class SearchresultWidget(QWidget):
-    def __init__(self, label_text, path, title, parent=None):
-        super(SearchresultWidget, self).__init__(parent)
-        allLayout = QVBoxLayout()
+from .snippets import format_snippet
+from .profiling import profiler
 
-        self.label = QLabel("test")
-        self.label.setObjectName("inner_label")
-        # self.label.setStyleSheet("#match{background-color: red;}")
-        allLayout.addWidget(self.label)
 
-        allLayout.setContentsMargins(5, 5, 5, 5)
-        self.setLayout(allLayout)
+def format_results(results):
+    """(html, path, section id) for each hit, as used by
+    Overlay.set_search_results"""
+    search_results = []
+    for i, result in enumerate(results):
+        if "content" in result["matched_fields"]:
+            high_content = format_snippet(result["snippets"]["content"]).replace("\n", "<br>")
+            html = "<b>{}</b><br>{}".format(format_snippet(result["snippets"]["title"]), high_content)
+        else:
+            highl_title = format_snippet(result["snippets"]["title"])
+            html = "<h4>{}</h4>".format(highl_title)
+        html_style = "<style>color: red</style>"
+        search_results.append((html_style+html, result["path"], result["section_id"]))
+    return search_results
+
+
+class SearchResultModel(QAbstractListModel):
+    """search results as (html, path, section id) tuples. Rows are made
+    available in pages as the view scrolls down (see fetchMore)"""
+    PathRole = Qt.UserRole
+    SectionIdRole = Qt.UserRole + 1
+
+    page_size = 50
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.results = []
+        self.loaded_count = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.loaded_count
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self.loaded_count:
+            return None
+        html, path, section_id = self.results[index.row()]
+        if role == Qt.DisplayRole:
+            return html
+        if role == self.PathRole:
+            return path
+        if role == self.SectionIdRole:
+            return section_id
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.loaded_count < len(self.results)
+
+    def fetchMore(self, parent=QModelIndex()):
+        count = min(self.page_size, len(self.results) - self.loaded_count)
+        self.beginInsertRows(QModelIndex(), self.loaded_count, self.loaded_count + count - 1)
+        self.loaded_count += count
+        self.endInsertRows()
+
+    def set_results(self, results):
+        """replaces the results without resetting the model: rows that exist
+        before and after are changed in place, the rest inserted or removed"""
+        old_count = self.loaded_count
+        new_count = min(len(results), max(old_count, self.page_size))
+        self.results = results
+
+        if new_count < old_count:
+            self.beginRemoveRows(QModelIndex(), new_count, old_count - 1)
+            self.loaded_count = new_count
+            self.endRemoveRows()
+        elif new_count > old_count:
+            self.beginInsertRows(QModelIndex(), old_count, new_count - 1)
+            self.loaded_count = new_count
+            self.endInsertRows()
+
+        changed_count = min(old_count, new_count)
+        if changed_count > 0:
+            self.dataChanged.emit(self.index(0), self.index(changed_count - 1))
+
+
+class SearchResultDelegate(QStyledItemDelegate):
+    """paints the html of a search result. The laid out documents are cached
+    per html and width"""
+    margin = 5
+    text_color = QColor("#f8f8f2")
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.documents = {}
+
+    def document(self, html, width):
+        key = (html, width)
+        document = self.documents.get(key)
+        if document is None:
+            if len(self.documents) > 500:
+                self.documents.clear()
+            document = QTextDocument()
+            document.setDocumentMargin(0)
+            document.setHtml(html)
+            document.setTextWidth(width)
+            self.documents[key] = document
+        return document
+
+    def paint(self, painter, option, index):
+        self.initStyleOption(option, index)
+        option.text = ""
+        widget = option.widget
+        style = widget.style() if widget else QApplication.style()
+        style.drawControl(QStyle.CE_ItemViewItem, option, painter, widget)
+
+        document = self.document(index.data(), option.rect.width() - 2 * self.margin)
+        context = QAbstractTextDocumentLayout.PaintContext()
+        context.palette.setColor(QPalette.Text, self.text_color)
+        painter.save()
+        painter.translate(option.rect.left() + self.margin, option.rect.top() + self.margin)
+        painter.setClipRect(QRectF(0, 0, option.rect.width() - 2 * self.margin, option.rect.height() - 2 * self.margin))
+        document.documentLayout().draw(painter, context)
+        painter.restore()
 
-        self.label.setText(label_text)
-        self.filename = path
-        self.part_title = title
+    def sizeHint(self, option, index):
+        width = option.rect.width() if option.rect.width() > 0 else 400
+        document = self.document(index.data(), width - 2 * self.margin)
+        return QSize(width, int(document.size().height()) + 2 * self.margin)
 
 
 class Overlay(QWidget):
@@ -28,11 +135,16 @@ class Overlay(QWidget):
         QWidget.__init__(self, parent)
         allLayout = QVBoxLayout()
 
-        self.l1 = QListWidget(self)
+        self.l1 = QListView(self)
         self.l1.setObjectName("search_result_list")
         self.l1.setViewMode(QListView.ListMode)
+        self.l1.setUniformItemSizes(False)
+        self.l1.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.model = SearchResultModel(self.l1)
+        self.l1.setModel(self.model)
+        self.l1.setItemDelegate(SearchResultDelegate(self.l1))
         # self.l1.currentItemChanged.connect(self.f1click)
-        self.l1.itemDoubleClicked.connect(self.item_dclick)
+        self.l1.doubleClicked.connect(self.item_dclick)
         allLayout.addWidget(self.l1)
         self.setLayout(allLayout)
 
@@ -46,28 +158,26 @@ class Overlay(QWidget):
         # print(parent.finder)
         # self.setFocusProxy(parent.finder)
 
-    def item_dclick(self, item):
+    def item_dclick(self, index):
         self.parent().goto_result()
 
     def get_selected_indices(self):
-        item_widget = self.l1.itemWidget(self.l1.currentItem())
-        return item_widget.filename, item_widget.part_title
+        index = self.l1.currentIndex()
+        return index.data(SearchResultModel.PathRole), index.data(SearchResultModel.SectionIdRole)
 
     def update_visibility(self, other_criteria=True):
-        if self.l1.count() > 0 and other_criteria:
+        if self.model.rowCount() > 0 and other_criteria:
             self.show()
         else:
             self.hide()
 
     def set_search_results(self, items):
-        self.l1.clear()
-        for item_text, path, title in items:
-            item_widget = SearchresultWidget(item_text, path, title)  # parent)
-            item = QListWidgetItem()
-            item.setSizeHint(item_widget.sizeHint())
-            self.l1.addItem(item)
-            self.l1.setItemWidget(item, item_widget)
-        self.l1.setCurrentRow(0)
+        self.model.set_results(items)
+        if self.model.rowCount() > 0:
+            self.l1.setCurrentIndex(self.model.index(0))
+            self.l1.scrollToTop()
+        # cached documents and row heights of the previous results are stale
+        self.l1.doItemsLayout()
 
 
 class IndexWorker(QThread):
@@ -76,24 +186,90 @@ class IndexWorker(QThread):
     def __init__(self, parent=None):
         QThread.__init__(self, parent)
 
-    def begin(self, writer, data):
-        self.writer = writer
-        self.data = data
+    def begin(self, core):
+        self.core = core
         self.start()
 
     def run(self):
-        for filename, topic in sorted(self.data.items(), key=lambda k: k[1]["title"]):
-            for part in topic["content"]:
-                self.writer.add_document(
-                    title="",
-                    _stored_title=part["title"],
-                    content=part["content"],
-                    time=topic["time"],
-                    path=filename
-                )
-                self.writer.add_document(
-                    title=part["title"],
-                    time=topic["time"],
-                    path=filename
-                )
-        self.writer.commit()
+        with profiler.capture("startup"):
+            self.core.sync_index()
+
+
+class MergeWorker(QThread):
+    """merges small index segments in the background, see
+    IndexManager.merge. segment_counts are the segments before and after"""
+
+    def __init__(self, parent=None):
+        QThread.__init__(self, parent)
+        self.segment_counts = None
+
+    def begin(self, core):
+        self.core = core
+        self.start()
+
+    def run(self):
+        self.segment_counts = self.core.merge_index()
+
+
+class SearchWorker(QThread):
+    """runs searches on its own thread. Only the latest submitted query is
+    run, queries that were overtaken by a newer one are dropped before and
+    after searching. The core keeps its query parser and searcher between
+    searches. A search that fails is logged and has no results, the thread
+    keeps running"""
+    results_ready = pyqtSignal(int, list)
+
+    def __init__(self, core, limit=10, parent=None):
+        QThread.__init__(self, parent)
+        self.core = core
+        self.limit = limit
+
+        self.mutex = QMutex()
+        self.condition = QWaitCondition()
+        self.query_text = None
+        self.query_id = 0
+        self.is_stopped = False
+
+    def submit(self, text):
+        """queues text as the next query and returns its id"""
+        with QMutexLocker(self.mutex):
+            self.query_id += 1
+            self.query_text = text
+            self.condition.wakeOne()
+            return self.query_id
+
+    def index_changed(self):
+        """the searcher is refreshed before the next query"""
+        self.core.index_changed()
+
+    def stop(self):
+        with QMutexLocker(self.mutex):
+            self.is_stopped = True
+            self.condition.wakeOne()
+        self.wait()
+
+    def is_current(self, query_id):
+        with QMutexLocker(self.mutex):
+            return query_id == self.query_id
+
+    def run(self):
+        while True:
+            with QMutexLocker(self.mutex):
+                while self.query_text is None and not self.is_stopped:
+                    self.condition.wait(self.mutex)
+                if self.is_stopped:
+                    break
+                text, query_id = self.query_text, self.query_id
+                self.query_text = None
+
+            try:
+                results = format_results(self.core.search(text, limit=self.limit))
+            except Exception:
+                # an exception escaping run() takes down the application
+                logging.exception("search for %r failed", text)
+                results = []
+            if self.is_current(query_id):
+                self.results_ready.emit(query_id, results)
+
+        # the searcher belongs to this thread
+        self.core.close()
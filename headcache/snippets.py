@@ -0,0 +1,117 @@
+"""search result snippets from the character offsets of the matched terms.
+
+The title and content fields store the offsets of their terms in the index
+(chars=True), so the part of a section with the most matches can be found
+without looking at its text. Only that window is sliced from the file text
+and highlighted, which keeps snippets as cheap for a long section as for a
+short one. Every matched term is highlighted, not only the typed text.
+
+The file text comes from the TextCache. If a hit's file isn't in it, the
+whole file is read, hashed and preprocessed once. The offsets are those of
+the preprocessed text, which can't be mapped to a position in the file
+without reading it"""
+import collections
+import html
+
+HIGHLIGHT_TEMPLATE = '<span style="color: rgb(0,0,0); background-color: rgba(255,231,146,220);">{}</span>'
+ELLIPSIS = "..."
+
+
+def find_spans(searcher, docnums, terms):
+    """{docnum: {fieldname: [(start, end, term number), ...]}} of terms, a
+    list of (fieldname, term), in the documents docnums. Like whoosh's
+    highlighter, each posting list is read once for all documents"""
+    from whoosh.reading import TermNotFound
+
+    reader = searcher.reader()
+    spans = {docnum: collections.defaultdict(list) for docnum in docnums}
+    ordered = sorted(spans)
+    for term_number, (fieldname, term) in enumerate(terms):
+        try:
+            matcher = reader.postings(fieldname, term)
+        except TermNotFound:
+            continue
+        for docnum in ordered:
+            if not matcher.is_active():
+                break
+            if matcher.id() < docnum:
+                matcher.skip_to(docnum)
+            if matcher.is_active() and matcher.id() == docnum:
+                spans[docnum][fieldname].extend(
+                    (start, end, term_number) for _, start, end in matcher.value_as("characters"))
+    return spans
+
+
+def merge_spans(spans):
+    """sorted (start, end) with overlapping and touching spans joined"""
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def best_window(spans, length):
+    """(start, spans) of the snippet of length characters for spans as
+    returned by find_spans: the window with the most different terms, then
+    the most matches, centered on them. Only the spans close to the window are
+    kept, enough to highlight it after it's moved to fit the section"""
+    if not spans:
+        return 0, []
+    spans = sorted(spans)
+    counts = collections.Counter()
+    best_score, best_first, best_last = None, 0, 0
+    first = 0
+    for last, (start, end, term) in enumerate(spans):
+        counts[term] += 1
+        while first < last and end - spans[first][0] > length:
+            counts[spans[first][2]] -= 1
+            if counts[spans[first][2]] == 0:
+                del counts[spans[first][2]]
+            first += 1
+        score = (len(counts), last - first)
+        if best_score is None or score > best_score:
+            best_score, best_first, best_last = score, first, last
+
+    covered_start = spans[best_first][0]
+    covered_end = max(end for start, end, term in spans[best_first:best_last + 1])
+    window_start = max(0, covered_start - max(0, length - (covered_end - covered_start)) // 2)
+    kept = [(start, end) for start, end, term in spans
+            if end > window_start - length and start < window_start + 2 * length]
+    return window_start, merge_spans(kept)
+
+
+def fragments(text, text_length, window, length):
+    """[(text, is_match), ...] of the snippet of a field. text(start, end)
+    returns part of the field, text_length is its length and window as
+    returned by best_window"""
+    window_start, spans = window
+    window_start = max(0, min(window_start, text_length - length))
+    window_end = min(text_length, window_start + length)
+
+    parts = []
+    if window_start > 0:
+        parts.append((ELLIPSIS, False))
+    window_text = text(window_start, window_end)
+    position = window_start
+    for start, end in spans:
+        start, end = max(start, position), min(end, window_end)
+        if start >= end:
+            continue
+        if start > position:
+            parts.append((window_text[position - window_start:start - window_start], False))
+        parts.append((window_text[start - window_start:end - window_start], True))
+        position = end
+    if position < window_end:
+        parts.append((window_text[position - window_start:], False))
+    if window_end < text_length:
+        parts.append((ELLIPSIS, False))
+    return parts
+
+
+def format_snippet(parts, template=HIGHLIGHT_TEMPLATE, escape=html.escape):
+    """text of fragments() with the matches put into template"""
+    return "".join(template.format(escape(text)) if is_match else escape(text) for text, is_match in parts)
@@ -0,0 +1,59 @@
+import collections
+import os.path
+import threading
+
+import mistune
+
+from .loader import read_note, note_hash
+
+
+class TextCache:
+    """LRU cache of the preprocessed text of recently used files, which the
+    section texts are sliced from (see notes.Section). Files are read again
+    when they're needed by the preview, the index or search results.
+
+    A file is only used if it still has the hash it was parsed with. If it
+    changed since, its sections are empty until it's parsed again (the file
+    watcher takes care of that). The preview, indexing and search threads
+    all read sections, hence the lock"""
+
+    def __init__(self, directory, size=256):
+        self.directory = directory
+        self.size = size
+        # filename -> (hash, text)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def text(self, filename, note):
+        """preprocessed text of the file note was parsed from, None if the
+        file changed or can't be read"""
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is not None and entry[0] == note.hash:
+                self.entries.move_to_end(filename)
+                return entry[1]
+
+        try:
+            content = read_note(os.path.join(self.directory, filename))
+        except OSError:
+            return None
+        if note_hash(content) != note.hash:
+            return None
+        text = mistune.preprocessing(content)
+
+        with self.lock:
+            self.entries[filename] = (note.hash, text)
+            self.entries.move_to_end(filename)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return text
+
+    def section_text(self, filename, note, section):
+        text = self.text(filename, note)
+        if text is None:
+            return ""
+        return text[section.start:section.end]
+
+    def invalidate(self, filename):
+        with self.lock:
+            self.entries.pop(filename, None)
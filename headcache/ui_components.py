@@ -1,7 +1,9 @@
+import bisect
+
 from PyQt5 import QtCore
-from PyQt5.QtCore import Qt, QRect
-from PyQt5.QtGui import QPainter, QBrush
-from PyQt5.QtWidgets import QLineEdit, QListWidget, QTextBrowser
+from PyQt5.QtCore import Qt, QRect, QSize, QAbstractListModel, QModelIndex, pyqtSignal
+from PyQt5.QtGui import QPainter, QBrush, QColor
+from PyQt5.QtWidgets import QLineEdit, QListView, QTextBrowser, QStyledItemDelegate, QStyle, QApplication
 
 
 class SearchBar(QLineEdit):
@@ -42,29 +44,187 @@ class SearchBar(QLineEdit):
         self.parent().parent().overlay.update_visibility(length_criteria)
 
 
-class IndicatorList(QListWidget):
+class FileListModel(QAbstractListModel):
+    """files sorted by filename. Rows are found and inserted by bisecting the
+    sorted filename list"""
+    FilenameRole = Qt.UserRole
+    ModifiedRole = Qt.UserRole + 1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.filenames = []
+        self.titles = {}
+        self.modified = set()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.filenames)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        filename = self.filenames[index.row()]
+        if role == Qt.DisplayRole:
+            return self.titles[filename]
+        if role == self.FilenameRole:
+            return filename
+        if role == self.ModifiedRole:
+            return filename in self.modified
+        return None
+
+    def row(self, filename):
+        """row of filename, -1 if it's not in the list"""
+        row = bisect.bisect_left(self.filenames, filename)
+        if row < len(self.filenames) and self.filenames[row] == filename:
+            return row
+        return -1
+
+    def filename(self, row):
+        if 0 <= row < len(self.filenames):
+            return self.filenames[row]
+        return None
+
+    def insert(self, filename, title):
+        row = bisect.bisect_left(self.filenames, filename)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.filenames.insert(row, filename)
+        self.titles[filename] = title
+        self.endInsertRows()
+
+    def remove(self, filename):
+        row = self.row(filename)
+        if row == -1:
+            raise RuntimeError("FileListModel.remove(fn={}): not in list".format(filename))
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.filenames[row]
+        del self.titles[filename]
+        self.modified.discard(filename)
+        self.endRemoveRows()
+
+    def set_title(self, filename, title):
+        self.titles[filename] = title
+        index = self.index(self.row(filename))
+        self.dataChanged.emit(index, index)
+
+    def set_modified(self, filename, modified):
+        if modified:
+            self.modified.add(filename)
+        else:
+            self.modified.discard(filename)
+        index = self.index(self.row(filename))
+        self.dataChanged.emit(index, index)
+
+    def clear(self):
+        self.beginResetModel()
+        self.filenames = []
+        self.titles = {}
+        self.modified = set()
+        self.endResetModel()
+
+
+class FileListDelegate(QStyledItemDelegate):
+    """paints the title of a file and its filename right aligned below"""
+    margin = 2
+    title_color = QColor("#f8f8f2")
+    modified_color = QColor("red")
+    filename_color = QColor(150, 150, 150)
+
+    def paint(self, painter, option, index):
+        self.initStyleOption(option, index)
+        option.text = ""
+        widget = option.widget
+        style = widget.style() if widget else QApplication.style()
+        style.drawControl(QStyle.CE_ItemViewItem, option, painter, widget)
+
+        rect = option.rect.adjusted(self.margin, 0, -self.margin, -self.margin)
+        line_height = option.fontMetrics.height()
+        painter.save()
+        is_modified = index.data(FileListModel.ModifiedRole)
+        painter.setPen(self.modified_color if is_modified else self.title_color)
+        title_rect = QRect(rect.left(), rect.top(), rect.width(), line_height)
+        painter.drawText(title_rect, Qt.AlignLeft | Qt.AlignVCenter,
+                         option.fontMetrics.elidedText(index.data(), Qt.ElideRight, rect.width()))
+        painter.setPen(self.filename_color)
+        filename_rect = QRect(rect.left(), rect.top() + line_height, rect.width(), line_height)
+        painter.drawText(filename_rect, Qt.AlignRight | Qt.AlignVCenter,
+                         option.fontMetrics.elidedText(index.data(FileListModel.FilenameRole), Qt.ElideLeft, rect.width()))
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), 2 * option.fontMetrics.height() + self.margin)
+
+
+def paint_focus_indicator(view):
+    """the tiny red line at the bottom of a view that has focus"""
+    qp = QPainter(view.viewport())
+    w = 1
+    r = QRect(0, view.height()-w, view.width(), w)
+    qp.fillRect(r, QBrush(QtCore.Qt.red))
+    qp.end()
+
+
+class IndicatorList(QListView):
+    """list view with a focus indicator. It's drawn with the view, which is
+    only repainted when the focus changes or the content scrolls (scrolling
+    moves the pixels of the old indicator, too)"""
+    focused = pyqtSignal()
+
     def __init__(self):
         super().__init__()
+
+    # QListWidget-like helpers for views on flat models
+    def count(self):
+        return self.model().rowCount() if self.model() else 0
+
+    def currentRow(self):
+        return self.currentIndex().row()
+
+    def setCurrentRow(self, row):
+        self.setCurrentIndex(self.model().index(row, 0))
+
+    def focusInEvent(self, ev):
+        super().focusInEvent(ev)
+        self.viewport().update()
+        self.focused.emit()
+
+    def focusOutEvent(self, ev):
+        super().focusOutEvent(ev)
+        self.viewport().update()
+
+    def scrollContentsBy(self, dx, dy):
+        super().scrollContentsBy(dx, dy)
+        if self.hasFocus():
+            self.viewport().update()
+
     def paintEvent(self, ev):
         super().paintEvent(ev)
         if self.hasFocus():
-            qp = QPainter(self.viewport())
-            w = 1
-            r = QRect(0, self.height()-w, self.width(), w)
-            qp.fillRect(r, QBrush(QtCore.Qt.red))
-            qp.end()
-        self.update()
+            paint_focus_indicator(self)
 
 
 class IndicatorTextBrowser(QTextBrowser):
+    """text browser with a focus indicator, see IndicatorList"""
+    focused = pyqtSignal()
+
     def __init__(self):
         super().__init__()
+
+    def focusInEvent(self, ev):
+        super().focusInEvent(ev)
+        self.viewport().update()
+        self.focused.emit()
+
+    def focusOutEvent(self, ev):
+        super().focusOutEvent(ev)
+        self.viewport().update()
+
+    def scrollContentsBy(self, dx, dy):
+        super().scrollContentsBy(dx, dy)
+        if self.hasFocus():
+            self.viewport().update()
+
     def paintEvent(self, ev):
         super().paintEvent(ev)
         if self.hasFocus():
-            qp = QPainter(self.viewport())
-            w = 1
-            r = QRect(0, self.height()-w, self.width(), w)
-            qp.fillRect(r, QBrush(QtCore.Qt.red))
-            qp.end()
-        self.update()
\ No newline at end of file
+            paint_focus_indicator(self)
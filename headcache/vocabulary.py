@@ -0,0 +1,148 @@
+"""the words of all notes, for typo tolerant search. A typed word that isn't
+found can be replaced with words within a small edit distance, which are
+looked up in a SymSpell style deletion dictionary: every word is stored under
+each string that's left after deleting up to max_distance of its characters.
+Two words within that distance share one of these strings, so finding them
+takes a few dictionary lookups instead of a scan of all words"""
+import re
+import sys
+import threading
+
+WORD_PATTERN = re.compile(r"\w+")
+# shorter words have too many neighbours to be worth correcting
+MIN_LENGTH = 4
+MAX_LENGTH = 24
+
+
+def note_words(text):
+    """the distinct words of a note that go into the vocabulary, sorted"""
+    return tuple(sorted({word for word in WORD_PATTERN.findall(text.lower())
+                         if MIN_LENGTH <= len(word) <= MAX_LENGTH}))
+
+
+def deletes(word, distance):
+    """word and all strings left after deleting up to distance characters"""
+    variants = {word}
+    current = {word}
+    for _ in range(distance):
+        current = {variant[:i] + variant[i + 1:] for variant in current for i in range(len(variant))}
+        variants |= current
+    return variants
+
+
+def edit_distance(a, b, limit):
+    """optimal string alignment distance (a swap of two neighbouring
+    characters is one edit), limit + 1 if it's bigger than limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+class Vocabulary:
+    """words of the notes with the number of notes they're in, kept up to
+    date note by note: update() with the words of a (re)parsed note (see
+    note_words), remove() for a deleted one. Only the deletions of words that
+    were added or removed are touched. The words of a note are only kept
+    here, not in the parsed notes.
+
+    Notes are updated on the reparse thread while searches look up words on
+    the search thread, hence the lock"""
+
+    def __init__(self, max_distance=1):
+        self.max_distance = max_distance
+        # word -> number of notes
+        self.counts = {}
+        # filename -> (note hash, words)
+        self.files = {}
+        # deletion -> word, or a list of words if there are several
+        self.deletions = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.counts)
+
+    def is_current(self, filename, note):
+        entry = self.files.get(filename)
+        return entry is not None and entry[0] == note.hash
+
+    def update(self, filename, note, words):
+        """sets the words of filename, parsed into note, to words"""
+        # interned, so they're shared between the notes
+        words = tuple(sys.intern(word) for word in words)
+        with self.lock:
+            old_words = self.files.get(filename, (None, ()))[1]
+            self.files[filename] = (note.hash, words)
+            self.add_words(set(words).difference(old_words))
+            self.remove_words(set(old_words).difference(words))
+
+    def remove(self, filename):
+        with self.lock:
+            entry = self.files.pop(filename, None)
+            if entry is not None:
+                self.remove_words(entry[1])
+
+    def add_words(self, words):
+        for word in words:
+            count = self.counts.get(word, 0)
+            self.counts[word] = count + 1
+            if count:
+                continue
+            for deletion in deletes(word, self.max_distance):
+                entry = self.deletions.get(deletion)
+                if entry is None:
+                    self.deletions[deletion] = word
+                elif isinstance(entry, str):
+                    self.deletions[deletion] = [entry, word]
+                else:
+                    entry.append(word)
+
+    def remove_words(self, words):
+        for word in words:
+            count = self.counts[word] - 1
+            if count:
+                self.counts[word] = count
+                continue
+            del self.counts[word]
+            for deletion in deletes(word, self.max_distance):
+                entry = self.deletions[deletion]
+                if isinstance(entry, str):
+                    del self.deletions[deletion]
+                else:
+                    entry.remove(word)
+                    if len(entry) == 1:
+                        self.deletions[deletion] = entry[0]
+
+    def similar(self, word, limit):
+        """at most limit words within max_distance of word (itself excluded),
+        closest first and the more common ones first among equally close"""
+        if not MIN_LENGTH <= len(word) <= MAX_LENGTH:
+            return []
+        with self.lock:
+            candidates = set()
+            for deletion in deletes(word, self.max_distance):
+                entry = self.deletions.get(deletion)
+                if entry is None:
+                    continue
+                if isinstance(entry, str):
+                    candidates.add(entry)
+                else:
+                    candidates.update(entry)
+            candidates.discard(word)
+            scored = []
+            for candidate in candidates:
+                distance = edit_distance(word, candidate, self.max_distance)
+                if distance <= self.max_distance:
+                    scored.append((distance, -self.counts[candidate], candidate))
+        return [candidate for _, _, candidate in sorted(scored)[:limit]]
@@ -12,6 +12,7 @@ setup(name='headcache',
       entry_points={
           'console_scripts': [
               'headcache = headcache.headcache:main',
+              'headcache-cli = headcache.cli:main',
           ],
       },
       install_requires=["mistune", "watchdog", "whoosh"],
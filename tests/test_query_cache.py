@@ -0,0 +1,81 @@
+"""searches answered or narrowed by the query cache find the same hits as
+uncached searches, for every keystroke of typed queries"""
+import random
+
+import pytest
+
+from benchmarks.corpus import generate
+from headcache.core import Headcache, DEFAULT_CONFIG
+
+LIMIT = 20
+
+NOTES = {
+    "fruit.md": "# fruit\n\n## bananas\n\nhello world with bananas\n\n## apples\n\nhello world with apples\n",
+    "split.md": "# split\n\n## world\n\nthe world split in two\n\n## other\n\nnothing to see\n",
+}
+
+QUERIES = [
+    "world bananas",
+    "world NOT bananas",
+    "world OR split",
+    "title:world",
+    "title:bananas OR apples",
+    '"hello world" apples',
+    "(world OR split) NOT apples",
+    "wor* split",
+    "hello ANDNOT bananas",
+]
+
+
+def typed(text):
+    """the queries while typing text and deleting its last word again"""
+    keystrokes = [text[:i] for i in range(1, len(text) + 1)]
+    if " " in text:
+        keystrokes += keystrokes[-2:text.rindex(" "):-1]
+    return keystrokes
+
+
+def found(hits):
+    return sorted((hit["section_id"], tuple(hit["matched_fields"])) for hit in hits)
+
+
+@pytest.fixture(scope="module", params=["ngram", "prefix"])
+def cores(request, tmp_path_factory):
+    """(cached, uncached) cores on the same notes and index"""
+    directory = str(tmp_path_factory.mktemp(request.param))
+    vocabulary = generate(directory, file_count=40, section_count=5, file_size=1500)
+    for filename, content in NOTES.items():
+        with open("{}/{}".format(directory, filename), "w") as file:
+            file.write(content)
+
+    config = dict(DEFAULT_CONFIG, search_engine=request.param)
+    cached = Headcache(directory, dict(config))
+    cached.load_data()
+    cached.sync_index()
+    uncached = Headcache(directory, dict(config, search_cache_size=0))
+    uncached.load_data()
+    yield cached, uncached, vocabulary
+    cached.close()
+    uncached.close()
+
+
+def test_typed_queries_match_uncached_search(cores):
+    cached, uncached, vocabulary = cores
+    rng = random.Random(0)
+    queries = QUERIES + ["{} {}".format(rng.choice(vocabulary), rng.choice(vocabulary)) for _ in range(30)]
+    queries += ["{} NOT {}".format(rng.choice(vocabulary), rng.choice(vocabulary)) for _ in range(5)]
+    queries += ["{} OR {}".format(rng.choice(vocabulary), rng.choice(vocabulary)) for _ in range(5)]
+
+    for query in queries:
+        for text in typed(query):
+            assert found(cached.search(text, limit=LIMIT)) == found(uncached.search(text, limit=LIMIT)), text
+
+
+def test_operators_are_part_of_the_key(cores):
+    cached, uncached, _ = cores
+    for text in ["world", "world bananas", "world NOT bananas", "world OR split"]:
+        assert found(cached.search(text, limit=LIMIT)) == found(uncached.search(text, limit=LIMIT)), text
+    if cached.config["search_engine"] == "ngram":
+        # the prefix engine has no query syntax
+        without_bananas = {hit["section_id"] for hit in cached.search("world NOT bananas", limit=LIMIT)}
+        assert without_bananas and all("bananas" not in section_id for section_id in without_bananas)